@@ -0,0 +1,101 @@
+# coding: utf-8
+
+"""
+Timing and memory measurement of calibrators, selectors and producers on synthetic chunks.
+"""
+
+from __future__ import annotations
+
+import gc
+import time
+import platform
+import tracemalloc
+from typing import Callable
+
+import law
+
+from columnflow.util import maybe_import
+from higgs_cp.benchmark.synthetic import make_chunk
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+logger = law.logger.get_logger(__name__)
+
+
+def measure(func: Callable, events: ak.Array, n_repeat: int = 3) -> dict:
+    """
+    Calls *func* with the *events* *n_repeat* times and returns a dict with the best wall time in
+    seconds, the corresponding number of events per second and the peak memory in bytes allocated
+    during one additional call, traced with tracemalloc. The traced call is not timed since
+    tracing slows down numpy and awkward allocations.
+    """
+    times = []
+    for _ in range(n_repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        func(events)
+        times.append(time.perf_counter() - t0)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(events)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(times)
+    return {
+        "n_events": len(events),
+        "time": best,
+        "times": times,
+        "events_per_second": len(events) / best if best > 0 else None,
+        "peak_memory": peak,
+    }
+
+
+def benchmark(
+    name: str,
+    func: Callable,
+    columns: set,
+    sizes: list[int],
+    n_repeat: int = 3,
+    seed: int = 42,
+    n_warmup: int = 1000,
+    **chunk_kwargs,
+) -> list[dict]:
+    """
+    Measures *func* on synthetic chunks with the *columns* for all chunk *sizes*, see
+    :py:func:`measure` and :py:func:`higgs_cp.benchmark.synthetic.make_chunk` for the
+    *chunk_kwargs*. A first call on *n_warmup* events compiles numba kernels and loads lazy
+    imports outside of the measurement. Returns one result dict per size, tagged with *name*.
+    """
+    func(make_chunk(columns, n_warmup, seed=seed, **chunk_kwargs))
+
+    results = []
+    for n_events in sizes:
+        events = make_chunk(columns, n_events, seed=seed, **chunk_kwargs)
+        result = {"name": name, **measure(func, events, n_repeat=n_repeat)}
+        logger.info(
+            f"{name}: {n_events} events, {result['time']:.3f} s, "
+            f"{result['events_per_second']:.0f} events/s, "
+            f"{result['peak_memory'] / 1024**2:.1f} MB peak memory",
+        )
+        results.append(result)
+        del events
+    return results
+
+
+def environment() -> dict:
+    """
+    Returns the versions of python and of the columnar packages, stored with the results to
+    compare them across environments.
+    """
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "awkward": ak.__version__,
+    }
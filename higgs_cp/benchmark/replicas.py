@@ -0,0 +1,235 @@
+# coding: utf-8
+
+"""
+Small local replicas of the external pileup, muon scale factor and tau correction files, with the
+structure of the originals but synthetic values, to run and profile the setup and the corrections
+of the weight producers and calibrators without access to the original files.
+"""
+
+from __future__ import annotations
+
+import os
+import gzip
+
+import law
+
+from columnflow.util import maybe_import
+from higgs_cp.config.util import external_replica_paths
+from higgs_cp.production.weights import muon_sf_hists
+
+
+np = maybe_import("numpy")
+
+logger = law.logger.get_logger(__name__)
+
+
+# means of the pileup profiles, data profiles for the minimum bias cross section varied by +-4.6%
+pileup_profiles = {
+    "data": 34.0,
+    "data_up": 34.0 * 72.4 / 69.2,
+    "data_down": 34.0 * 66.0 / 69.2,
+    "mc": 32.0,
+}
+
+# binning of the muon scale factor histograms, pt on the x and eta on the y axis
+muon_sf_edges = (
+    [20.0, 24.0, 26.0, 30.0, 40.0, 50.0, 60.0, 120.0, 200.0],
+    [-2.4, -2.1, -1.2, -0.9, 0.0, 0.9, 1.2, 2.1, 2.4],
+)
+
+# working points and categories of the tau corrections
+deep_tau_wps = ("VVVLoose", "VVLoose", "VLoose", "Loose", "Medium", "Tight", "VTight", "VVTight")
+deep_tau_vs_mu_wps = ("VLoose", "Loose", "Medium", "Tight")
+tau_decay_modes = (0, 1, 2, 10, 11)
+tau_systs = ("nom", "up", "down")
+tau_pt_edges = [20.0, 25.0, 30.0, 35.0, 40.0, 50.0, 70.0, 100.0, 1000.0]
+tau_abseta_edges = [0.0, 0.4, 0.8, 1.2, 1.46, 1.558, 1.7, 2.3, 2.5]
+
+
+def write_pileup_replica(path: str, mean: float, rng: np.random.Generator) -> None:
+    """
+    Writes the histogram ``pileup`` with 100 unit bins from 0 to 100, filled with a normalised
+    gamma profile with the given *mean*, to the ROOT file *path*.
+    """
+    import uproot
+    edges = np.arange(101, dtype=np.float64)
+    centers = edges[:-1] + 0.5
+    shape = 6.0
+    values = centers ** (shape - 1) * np.exp(-centers * shape / mean)
+    values *= rng.uniform(0.98, 1.02, len(values))
+    with uproot.recreate(path) as f:
+        f["pileup"] = (values / values.sum(), edges)
+
+
+def write_muon_sf_replica(path: str, rng: np.random.Generator) -> None:
+    """
+    Writes the trigger, ID and isolation scale factor histograms in *muon_sf_hists* with their
+    uncertainties as variances to the ROOT file *path*.
+    """
+    import uproot
+    import hist
+    with uproot.recreate(path) as f:
+        for hist_name in muon_sf_hists.values():
+            h = hist.Hist(
+                hist.axis.Variable(muon_sf_edges[0], name="pt"),
+                hist.axis.Variable(muon_sf_edges[1], name="eta"),
+                storage=hist.storage.Weight(),
+            )
+            shape = h.axes.size
+            h.view().value = rng.uniform(0.93, 1.0, shape)
+            h.view().variance = rng.uniform(0.002, 0.02, shape) ** 2
+            f[hist_name] = h
+
+
+def _category(name: str, keys: tuple, content, default=None):
+    # category node with the same *content* for all keys, or a callable of the key
+    from correctionlib import schemav2 as schema
+    return schema.Category(
+        nodetype="category",
+        input=name,
+        content=[
+            schema.CategoryItem(key=key, value=content(key) if callable(content) else content)
+            for key in keys
+        ],
+        default=default,
+    )
+
+
+def _binning(name: str, edges: list, values: np.ndarray):
+    from correctionlib import schemav2 as schema
+    return schema.Binning(
+        nodetype="binning",
+        input=name,
+        edges=edges,
+        content=[float(v) for v in values],
+        flow="clamp",
+    )
+
+
+def _variable(name: str, type: str, description: str):
+    from correctionlib import schemav2 as schema
+    return schema.Variable(name=name, type=type, description=description)
+
+
+def write_tau_correction_replica(path: str, tagger: str, rng: np.random.Generator) -> None:
+    """
+    Writes a correction set with the tau ID scale factors ``<tagger>VSjet``, ``<tagger>VSe`` and
+    ``<tagger>VSmu`` and the ``tau_energy_scale``, with the inputs of the TAU POG corrections, to
+    the json file *path*, gzipped when it ends with ``.gz``. Unlike the originals, unknown decay
+    modes and gen matches are assigned a factor of one.
+    """
+    from correctionlib import schemav2 as schema
+
+    def per_syst(nominal, input_name, edges, shift):
+        # nominal values and values shifted by the relative uncertainty *shift* per variation
+        scale = {"nom": 1.0, "up": 1.0 + shift, "down": 1.0 - shift}
+        return _category("syst", tau_systs, lambda syst: _binning(input_name, edges, nominal * scale[syst]))
+
+    def per_dm(input_name, edges, low, high, shift):
+        return _category("dm", tau_decay_modes, lambda dm: per_syst(
+            rng.uniform(low, high, len(edges) - 1), input_name, edges, shift,
+        ), default=1.0)
+
+    vs_jet = schema.Correction(
+        name=f"{tagger}VSjet",
+        description=f"{tagger} VSjet scale factors, local replica",
+        version=0,
+        inputs=[
+            _variable("pt", "real", "tau pt"),
+            _variable("dm", "int", "tau decay mode"),
+            _variable("genmatch", "int", "genPartFlav"),
+            _variable("wp", "string", "VSjet working point"),
+            _variable("wp_VSe", "string", "VSe working point"),
+            _variable("syst", "string", "systematic variation: nom, up, down"),
+            _variable("flag", "string", "scale factors binned in dm or pt"),
+        ],
+        output=_variable("sf", "real", "scale factor"),
+        data=_category("genmatch", (5,), _category("wp", deep_tau_wps, _category(
+            "wp_VSe", deep_tau_wps, _category("flag", ("dm", "pt"), lambda flag: (
+                per_dm("pt", tau_pt_edges, 0.85, 1.0, 0.03) if flag == "dm" else
+                per_syst(rng.uniform(0.85, 1.0, len(tau_pt_edges) - 1), "pt", tau_pt_edges, 0.03)
+            )),
+        )), default=1.0),
+    )
+    vs_e = schema.Correction(
+        name=f"{tagger}VSe",
+        description=f"{tagger} VSe scale factors, local replica",
+        version=0,
+        inputs=[
+            _variable("eta", "real", "tau abs(eta)"),
+            _variable("dm", "int", "tau decay mode"),
+            _variable("genmatch", "int", "genPartFlav"),
+            _variable("wp", "string", "VSe working point"),
+            _variable("syst", "string", "systematic variation: nom, up, down"),
+        ],
+        output=_variable("sf", "real", "scale factor"),
+        data=_category("genmatch", (1, 3), _category(
+            "wp", deep_tau_wps, per_dm("eta", tau_abseta_edges, 0.8, 1.6, 0.1),
+        ), default=1.0),
+    )
+    vs_mu = schema.Correction(
+        name=f"{tagger}VSmu",
+        description=f"{tagger} VSmu scale factors, local replica",
+        version=0,
+        inputs=[
+            _variable("eta", "real", "tau abs(eta)"),
+            _variable("genmatch", "int", "genPartFlav"),
+            _variable("wp", "string", "VSmu working point"),
+            _variable("syst", "string", "systematic variation: nom, up, down"),
+        ],
+        output=_variable("sf", "real", "scale factor"),
+        data=_category("genmatch", (2, 4), _category("wp", deep_tau_vs_mu_wps, per_syst(
+            rng.uniform(0.8, 1.4, len(tau_abseta_edges) - 1), "eta", tau_abseta_edges, 0.1,
+        )), default=1.0),
+    )
+    tes = schema.Correction(
+        name="tau_energy_scale",
+        description=f"{tagger} tau energy scale, local replica",
+        version=0,
+        inputs=[
+            _variable("pt", "real", "tau pt"),
+            _variable("eta", "real", "tau abs(eta)"),
+            _variable("dm", "int", "tau decay mode"),
+            _variable("genmatch", "int", "genPartFlav"),
+            _variable("id", "string", "tau ID algorithm"),
+            _variable("wp", "string", "VSjet working point"),
+            _variable("wp_VSe", "string", "VSe working point"),
+            _variable("syst", "string", "systematic variation: nom, up, down"),
+        ],
+        output=_variable("tes", "real", "tau energy scale"),
+        data=_category("id", (tagger,), _category("genmatch", (1, 3, 5), lambda genmatch: (
+            _category("wp", deep_tau_wps, _category(
+                "wp_VSe", deep_tau_wps, per_dm("pt", tau_pt_edges, 0.97, 1.02, 0.01),
+            )) if genmatch == 5 else
+            per_dm("eta", tau_abseta_edges, 0.98, 1.04, 0.01)
+        ), default=1.0)),
+    )
+
+    correction_set = schema.CorrectionSet(
+        schema_version=2,
+        description="local replica of the TAU POG corrections",
+        corrections=[vs_jet, vs_e, vs_mu, tes],
+    )
+    content = correction_set.model_dump_json(exclude_unset=True).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(gzip.compress(content) if path.endswith(".gz") else content)
+
+
+def make_external_replicas(config_inst, directory: str, seed: int = 42) -> dict[str, str]:
+    """
+    Writes local replicas of the pileup profiles, the muon scale factors and the tau corrections
+    in the external files of the *config_inst* to *directory*, see
+    :py:func:`higgs_cp.config.util.external_replica_paths`, and returns their paths.
+    """
+    rng = np.random.default_rng(seed)
+    paths = external_replica_paths(config_inst, directory)
+    for key, path in paths.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if key.startswith("pileup."):
+            write_pileup_replica(path, pileup_profiles[key.split(".", 1)[1]], rng)
+        elif key == "muon_correction":
+            write_muon_sf_replica(path, rng)
+        elif key == "tau_correction":
+            write_tau_correction_replica(path, config_inst.x.deep_tau.tagger, rng)
+        logger.info(f"written replica of {key} to {path}")
+    return paths
@@ -0,0 +1,205 @@
+# coding: utf-8
+
+"""
+Synthetic NanoAOD-like event chunks for benchmarking calibrators, selectors and producers
+without input files.
+"""
+
+from __future__ import annotations
+
+import math
+
+from columnflow.util import maybe_import
+from columnflow.columnar_util import Route
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+# mean multiplicities of the jagged collections, drawn from a poisson distribution per event,
+# all other top-level fields (HLT, PuppiMET, Pileup, ...) are records with one entry per event
+collection_multiplicities = {
+    "Muon": 1.5,
+    "Electron": 1.0,
+    "Tau": 2.5,
+    "Jet": 5.0,
+    "TrigObj": 8.0,
+    "Photon": 1.0,
+    "SV": 1.0,
+    "GenJet": 6.0,
+    "GenPart": 40.0,
+}
+
+# collections that hold only the selected pair after the reduction
+reduced_collections = ("Muon", "Tau")
+
+# value distributions, looked up by the full column name, "<collection>.*" and the field name,
+# field names with a suffix like Tau.pt_tes_up fall back to the part before the first underscore
+# (kind, parameters, dtype), exponential parameters are the scale and the offset
+field_specs = {
+    "pt": ("exponential", (30.0, 15.0), "float32"),
+    "eta": ("uniform", (-2.5, 2.5), "float32"),
+    "phi": ("uniform", (-math.pi, math.pi), "float32"),
+    "mass": ("uniform", (0.1, 1.7), "float32"),
+    "charge": ("choice", ((-1, 1),), "int32"),
+    "dxy": ("normal", (0.0, 0.01), "float32"),
+    "dz": ("normal", (0.0, 0.05), "float32"),
+    "pfRelIso04_all": ("exponential", (0.15, 0.0), "float32"),
+    "pfRelIso03_all": ("exponential", (0.15, 0.0), "float32"),
+    "mediumId": ("bernoulli", (0.9,), "bool"),
+    "isPFcand": ("bernoulli", (0.95,), "bool"),
+    "isGlobal": ("bernoulli", (0.9,), "bool"),
+    "isTracker": ("bernoulli", (0.95,), "bool"),
+    "decayMode": ("choice", ((0, 1, 2, 10, 11),), "int32"),
+    "decayModePNet": ("choice", ((0, 1, 2, 10, 11),), "int32"),
+    "genPartFlav": ("choice", ((0, 1, 2, 3, 4, 5),), "uint8"),
+    "idDeepTau2018v2p5VSjet": ("integers", (0, 9), "uint8"),
+    "idDeepTau2018v2p5VSe": ("integers", (0, 9), "uint8"),
+    "idDeepTau2018v2p5VSmu": ("integers", (0, 5), "uint8"),
+    "rawDeepTau2018v2p5VSjet": ("uniform", (0.0, 1.0), "float32"),
+    "btagDeepFlavB": ("uniform", (0.0, 1.0), "float32"),
+    "filterBits": ("integers", (0, 4096), "int32"),
+    "jetIdx": ("constant", (-1,), "int16"),
+    "nStations": ("integers", (1, 5), "int32"),
+    "nConstituents": ("integers", (2, 40), "uint8"),
+    "nElectrons": ("integers", (0, 2), "uint8"),
+    "nMuons": ("integers", (0, 2), "uint8"),
+    "run": ("constant", (362000,), "uint32"),
+    "luminosityBlock": ("integers", (1, 2000), "uint32"),
+    "genWeight": ("choice", ((-1.0, 1.0),), "float32"),
+    "mc_weight": ("choice", ((-1.0, 1.0),), "float32"),
+    "nTrueInt": ("uniform", (0.0, 80.0), "float32"),
+    "Muon.mass": ("constant", (0.1057,), "float32"),
+    "Jet.pt": ("exponential", (40.0, 20.0), "float32"),
+    "Jet.eta": ("uniform", (-4.7, 4.7), "float32"),
+    "Jet.mass": ("exponential", (10.0, 2.0), "float32"),
+    "TrigObj.id": ("choice", ((1, 11, 13, 15, 22),), "int32"),
+    "HLT.*": ("bernoulli", (0.3,), "bool"),
+    "LHEWeight.*": ("choice", ((-1.0, 1.0),), "float32"),
+}
+
+default_field_spec = ("uniform", (0.0, 1.0), "float32")
+
+
+def get_field_spec(route: Route) -> tuple:
+    """
+    Returns the (kind, parameters, dtype) of the values of the column *route*, see *field_specs*.
+    """
+    field = route.fields[-1]
+    for key in [route.column, f"{route.fields[0]}.*", field, field.split("_", 1)[0]]:
+        if key in field_specs:
+            return field_specs[key]
+    return default_field_spec
+
+
+def sample_values(rng: np.random.Generator, spec: tuple, n: int) -> np.ndarray:
+    """
+    Draws *n* values following the (kind, parameters, dtype) *spec* with the generator *rng*.
+    """
+    kind, params, dtype = spec
+    if kind == "uniform":
+        values = rng.uniform(*params, n)
+    elif kind == "normal":
+        values = rng.normal(*params, n)
+    elif kind == "exponential":
+        values = rng.exponential(params[0], n) + params[1]
+    elif kind == "integers":
+        values = rng.integers(*params, n)
+    elif kind == "choice":
+        values = rng.choice(params[0], n)
+    elif kind == "bernoulli":
+        values = rng.random(n) < params[0]
+    elif kind == "constant":
+        values = np.full(n, params[0])
+    else:
+        raise ValueError(f"unknown kind '{kind}' of field spec {spec}")
+    return values.astype(dtype)
+
+
+def make_chunk(
+    columns: set[Route | str],
+    n_events: int,
+    seed: int = 42,
+    reduced: bool = False,
+    constants: dict | None = None,
+) -> ak.Array:
+    """
+    Creates a chunk of *n_events* synthetic events with all *columns*, e.g. the ``used_columns`` of
+    a calibrator, selector or producer. Collections in *collection_multiplicities* are jagged with
+    a poisson distributed number of objects per event, values are drawn from *field_specs*. When
+    *reduced* is *True*, the collections in *reduced_collections* hold exactly one object, as after
+    the reduction. Columns in *constants*, e.g. ``{"process_id": 1}``, are set to the given value.
+    The first trigger object of every event with a muon is placed on the first muon to obtain
+    realistic trigger matching rates.
+    """
+    rng = np.random.default_rng(seed)
+    constants = constants or {}
+
+    # group the columns into top-level fields
+    fields = {}
+    for route in sorted(map(Route, columns), key=str):
+        fields.setdefault(route.fields[0], {})[route] = route
+
+    # offsets of the jagged collections
+    offsets = {}
+    for name in fields:
+        if name not in collection_multiplicities:
+            continue
+        if reduced and name in reduced_collections:
+            counts = np.ones(n_events, dtype=np.int64)
+        else:
+            counts = rng.poisson(collection_multiplicities[name], n_events)
+        offsets[name] = np.zeros(n_events + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[name][1:])
+
+    # flat values of all columns
+    values = {}
+    for name, routes in fields.items():
+        n = int(offsets[name][-1]) if name in offsets else n_events
+        for route in routes:
+            if route.column in constants:
+                values[route] = np.full(n, constants[route.column])
+            elif route.column == "event":
+                values[route] = np.arange(1, n + 1, dtype=np.uint64)
+            else:
+                values[route] = sample_values(rng, get_field_spec(route), n)
+
+    # place the first trigger object on the first muon
+    trig_obj = ("TrigObj.pt", "TrigObj.eta", "TrigObj.phi")
+    if "Muon" in offsets and "TrigObj" in offsets and all(Route(c) in values for c in trig_obj):
+        has_obj = (np.diff(offsets["Muon"]) > 0) & (np.diff(offsets["TrigObj"]) > 0)
+        obj_idx = offsets["TrigObj"][:-1][has_obj]
+        mu_idx = offsets["Muon"][:-1][has_obj]
+        for var in ["pt", "eta", "phi"]:
+            if Route(f"Muon.{var}") in values:
+                values[Route(f"TrigObj.{var}")][obj_idx] = values[Route(f"Muon.{var}")][mu_idx]
+        if Route("TrigObj.id") in values:
+            values[Route("TrigObj.id")][obj_idx] = 13
+        if Route("TrigObj.filterBits") in values:
+            values[Route("TrigObj.filterBits")][obj_idx] |= 2
+
+    # build the layout, collections share their offsets
+    def record(routes, depth):
+        children = {}
+        for route in routes:
+            children.setdefault(route.fields[depth], []).append(route)
+        contents = [
+            ak.contents.NumpyArray(values[sub_routes[0]])
+            if len(sub_routes) == 1 and len(sub_routes[0]) == depth + 1
+            else record(sub_routes, depth + 1)
+            for sub_routes in children.values()
+        ]
+        return ak.contents.RecordArray(contents, list(children.keys()))
+
+    contents = {}
+    for name, routes in fields.items():
+        if len(routes) == 1 and len(next(iter(routes))) == 1:
+            content = ak.contents.NumpyArray(values[next(iter(routes))])
+        else:
+            content = record(list(routes), 1)
+        if name in offsets:
+            content = ak.contents.ListOffsetArray(ak.index.Index64(offsets[name]), content)
+        contents[name] = content
+
+    return ak.Array(ak.contents.RecordArray(list(contents.values()), list(contents.keys()), length=n_events))
@@ -10,6 +10,8 @@ from columnflow.calibration import Calibrator, calibrator
 from columnflow.production.cms.seeds import deterministic_seeds
 from columnflow.util import maybe_import, InsertableDict
 from columnflow.columnar_util import set_ak_column, flat_np_view
+from higgs_cp.util import flat_content, jagged_from_offsets
+from higgs_cp.corrections import load_correction_set
 
 
 np = maybe_import("numpy")
@@ -17,13 +19,21 @@ ak = maybe_import("awkward")
 
 set_ak_column_f32 = functools.partial(set_ak_column, value_type=np.float32)
 
+# variations of the tau energy scale, nominal values are written to Tau.pt and Tau.mass
+tes_systs = ("nom", "up", "down")
+
+# shifts whose column aliases swap in the varied tau pt and mass written by tau_energy_scale in the
+# nominal calibration, declared by the selector only so that the calibration is not repeated
+tes_shifts = {"tes_up", "tes_down"}
+
 @calibrator(
     uses={f"Tau.{var}" for var in [
                 "pt","eta","mass", "decayMode", "genPartFlav"
                 ] 
     },
     produces={
-        "Tau.pt", "Tau.mass", "Tau.pt_no_tes", "Tau.mass_no_tes" 
+        "Tau.pt", "Tau.mass", "Tau.pt_no_tes", "Tau.mass_no_tes",
+        "Tau.pt_tes_up", "Tau.mass_tes_up", "Tau.pt_tes_down", "Tau.mass_tes_down",
     },
     mc_only=True,
 )
@@ -32,40 +42,39 @@ def tau_energy_scale(self: Calibrator, events: ak.Array, **kwargs) -> ak.Array:
     if self.dataset_inst.is_data:
         raise ValueError("attempt to apply tau energy corrections in data")
     
-    # the correction tool only supports flat arrays, so convert inputs to flat np view first
-    pt = flat_np_view(events.Tau.pt, axis=1)
-    mass = flat_np_view(events.Tau.mass, axis=1)
-    abseta = flat_np_view(abs(events.Tau.eta), axis=1)
+    # the correction tool only supports flat arrays, so work on the flat content of the taus and
+    # rebuild all output columns on the offsets of Tau.pt without copying them
+    offsets, pt = flat_content(events.Tau.pt)
+    _, mass = flat_content(events.Tau.mass)
+    abseta = np.abs(flat_np_view(events.Tau.eta, axis=1))
     dm = flat_np_view(events.Tau.decayMode, axis=1)
     match = flat_np_view(events.Tau.genPartFlav, axis=1)
     
-    syst = "nom" # TODO define this systematics inside config file
      #Get working points of the DeepTau tagger
     deep_tau = self.config_inst.x.deep_tau
    
-    #Create get energy scale correction for each tau
-    tes_nom = np.ones_like(pt, dtype=np.float32)
-    #Calculate tau ID scale factors for genuine taus
-    # pt, eta, dm, genmatch, deep_tau_id, jet_wp, e_wp, syst
+    #Create get energy scale correction for each tau and each systematic variation
+    tes = np.ones((len(tes_systs), len(pt)), dtype=np.float32)
+    #The inputs of taus with a correction are gathered once and shared by all variations
     mask2prong = ((dm != 5) & (dm != 6))
-    tes_args = lambda events, mask, deep_tau_obj, syst: (pt[mask],
-                                                         abseta[mask],
-                                                         dm[mask],
-                                                         match[mask],
-                                                         deep_tau_obj.tagger,
-                                                         deep_tau_obj.vs_jet,
-                                                         deep_tau_obj.vs_e,
+    pt_m, abseta_m, dm_m, match_m = pt[mask2prong], abseta[mask2prong], dm[mask2prong], match[mask2prong]
+    for i, syst in enumerate(tes_systs):
+        # pt, eta, dm, genmatch, deep_tau_id, jet_wp, e_wp, syst
+        tes[i, mask2prong] = self.tes_corrector.evaluate(pt_m,
+                                                         abseta_m,
+                                                         dm_m,
+                                                         match_m,
+                                                         deep_tau.tagger,
+                                                         deep_tau.vs_jet,
+                                                         deep_tau.vs_e,
                                                          syst)
-    tes_nom[mask2prong] = self.tes_corrector.evaluate(*tes_args(events, mask2prong,deep_tau, syst))
-    tes_nom     = np.asarray(tes_nom)
-    tau_pt      = np.asarray(ak.flatten(events.Tau.pt))
-    tau_mass    = np.asarray(ak.flatten(events.Tau.mass))
-    arr_shape = ak.num(events.Tau.pt, axis=1)
     
-    events = set_ak_column_f32(events, "Tau.pt_no_tes", ak.unflatten(tau_pt, arr_shape))
-    events = set_ak_column_f32(events, "Tau.mass_no_tes", ak.unflatten(tau_mass, arr_shape))
-    events = set_ak_column_f32(events, "Tau.pt", ak.unflatten(tau_pt * tes_nom, arr_shape))
-    events = set_ak_column_f32(events, "Tau.mass", ak.unflatten(tau_mass * tes_nom, arr_shape))
+    events = set_ak_column_f32(events, "Tau.pt_no_tes", jagged_from_offsets(offsets, pt))
+    events = set_ak_column_f32(events, "Tau.mass_no_tes", jagged_from_offsets(offsets, mass))
+    for syst, tes_syst in zip(tes_systs, tes):
+        postfix = "" if syst == "nom" else f"_tes_{syst}"
+        events = set_ak_column_f32(events, f"Tau.pt{postfix}", jagged_from_offsets(offsets, pt * tes_syst))
+        events = set_ak_column_f32(events, f"Tau.mass{postfix}", jagged_from_offsets(offsets, mass * tes_syst))
     return events
 
 @tau_energy_scale.requires
@@ -84,11 +93,7 @@ def tau_energy_scale_setup(
     reader_targets: InsertableDict,
 ) -> None:
     bundle = reqs["external_files"]
-    import correctionlib
-    correctionlib.highlevel.Correction.__call__ = correctionlib.highlevel.Correction.evaluate
-    
-    correction_set = correctionlib.CorrectionSet.from_string(
-        bundle.files.tau_correction.load(formatter="gzip").decode("utf-8"),
-    )
+    #The correction set is parsed once per process and shared with other calibrators and producers
+    correction_set = load_correction_set(bundle.files.tau_correction)
     tagger_name = self.config_inst.x.deep_tau.tagger
     self.tes_corrector = correction_set["tau_energy_scale"]
\ No newline at end of file
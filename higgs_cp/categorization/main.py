@@ -6,6 +6,7 @@ Exemplary selection methods.
 
 from columnflow.categorization import Categorizer, categorizer
 from columnflow.util import maybe_import
+from higgs_cp.util import abcd_regions
 
 
 ak = maybe_import("awkward")
@@ -23,28 +24,25 @@ def cat_incl(self: Categorizer, events: ak.Array, **kwargs) -> tuple[ak.Array, a
 #Check this link for the explanation about ABCD method and categories' definition.
 #https://cms-opendata-workshop.github.io/workshop-lesson-abcd-method/01-introduction/index.html
 
-@categorizer(uses={"rel_charge", "Muon.pfRelIso04_all"})
+#The regions are obtained in a single pass by the abcd_region producer, see
+#higgs_cp.util.abcd_regions for the codes and cfg.x.abcd_iso_edges for the isolation bins
+
+@categorizer(uses={"abcd_region"})
 def cat_c(self: Categorizer, events: ak.Array, **kwargs) -> tuple[ak.Array, ak.Array]:
     #Control region ( iso < 0.15, same sign pair)
-    sel = (events.rel_charge > 0) & (ak.firsts(events.Muon.pfRelIso04_all, axis=1) < 0.15)
-    return events, sel
+    return events, events.abcd_region == abcd_regions["cat_c"]
 
-@categorizer(uses={"rel_charge", "Muon.pfRelIso04_all"})
+@categorizer(uses={"abcd_region"})
 def cat_d(self: Categorizer, events: ak.Array, **kwargs) -> tuple[ak.Array, ak.Array]:
     #Signal region ( iso < 0.15, opposite sign pair)
-    sel = (events.rel_charge < 0) & (ak.firsts(events.Muon.pfRelIso04_all, axis=1) < 0.15)
-    return events, sel
+    return events, events.abcd_region == abcd_regions["cat_d"]
 
-@categorizer(uses={"rel_charge", "Muon.pfRelIso04_all"})
+@categorizer(uses={"abcd_region"})
 def cat_a(self: Categorizer, events: ak.Array, **kwargs) -> tuple[ak.Array, ak.Array]:
-    #Region for transfer factor calculation( iso > 0.15, same sign pair)
-    sel = (events.rel_charge > 0) & (ak.firsts(events.Muon.pfRelIso04_all, axis=1) >= 0.15)  \
-        & (ak.firsts(events.Muon.pfRelIso04_all, axis=1) <= 0.30)
-    return events, sel
+    #Region for transfer factor calculation( 0.15 <= iso <= 0.30, same sign pair)
+    return events, events.abcd_region == abcd_regions["cat_a"]
 
-@categorizer(uses={"rel_charge", "Muon.pfRelIso04_all"})
+@categorizer(uses={"abcd_region"})
 def cat_b(self: Categorizer, events: ak.Array, **kwargs) -> tuple[ak.Array, ak.Array]:
-    #Region for transfer factor calculation( iso > 0.15, opposite sign pair)
-    sel = (events.rel_charge < 0) & (ak.firsts(events.Muon.pfRelIso04_all, axis=1) >= 0.15) \
-        & (ak.firsts(events.Muon.pfRelIso04_all, axis=1) <= 0.30)
-    return events, sel
+    #Region for transfer factor calculation( 0.15 <= iso <= 0.30, opposite sign pair)
+    return events, events.abcd_region == abcd_regions["cat_b"]
@@ -13,6 +13,7 @@ from scinum import Number
 from columnflow.util import DotDict, maybe_import, dev_sandbox
 from columnflow.config_util import (
     get_root_processes_from_campaign, 
+    get_shifts_from_sources,
     add_category,
     verify_config_processes,
 )
@@ -104,6 +105,10 @@ def add_run3_postEE(ana: od.Analysis,
     cfg.x.default_categories = ("incl",)
     cfg.x.default_variables = ("n_jet", "jet1_pt")
 
+    # flags of the selection and production steps and the tau flavour splits, see add_feature_flags
+    from higgs_cp.config.util import add_feature_flags
+    add_feature_flags(cfg)
+
     # process groups for conveniently looping over certain processs
     # (used in wrapper_factory and during plotting)
     cfg.x.process_groups = {}
@@ -153,6 +158,14 @@ def add_run3_postEE(ana: od.Analysis,
     # register shifts
     cfg.add_shift(name="nominal", id=0)
 
+    # tau id scale factor variations, see higgs_cp.config.util.add_tau_id_shifts
+    from higgs_cp.config.util import add_tau_id_shifts
+    add_tau_id_shifts(cfg)
+
+    # tau energy scale variations, see higgs_cp.config.util.add_tes_shifts
+    from higgs_cp.config.util import add_tes_shifts
+    add_tes_shifts(cfg)
+
     # tune shifts are covered by dedicated, varied datasets, so tag the shift as "disjoint_from_nominal"
     # (this is currently used to decide whether ML evaluations are done on the full shifted dataset)
     #cfg.add_shift(name="tune_up", id=1, type="shape", tags={"disjoint_from_nominal"})
@@ -211,12 +224,19 @@ def add_run3_postEE(ana: od.Analysis,
         "pileup":{
             #"json": ("/eos/user/c/cmsdqm/www/CAF/certification/Collisions22/PileUp/EFG/pileup_JSON.txt", "v1")
             "data" : "/afs/cern.ch/user/s/stzakhar/work/run3_taufw/CMSSW_10_6_13/src/TauFW/PicoProducer/data/pileup/Data_PileUp_2022_postEE.root",
+            # data profiles for the minimum bias cross section varied by +-4.6%, following the nominal one
+            "data_up"   : "/afs/cern.ch/user/s/stzakhar/work/run3_taufw/CMSSW_10_6_13/src/TauFW/PicoProducer/data/pileup/Data_PileUp_2022_postEE_72p4.root",
+            "data_down" : "/afs/cern.ch/user/s/stzakhar/work/run3_taufw/CMSSW_10_6_13/src/TauFW/PicoProducer/data/pileup/Data_PileUp_2022_postEE_66p0.root",
             "mc"   : "/afs/cern.ch/user/s/stzakhar/work/run3_taufw/CMSSW_10_6_13/src/TauFW/PicoProducer/data/pileup/MC_PileUp_2022.root"
         },
-        "muon_correction" : "/afs/cern.ch/user/s/stzakhar/work/run3_taufw/CMSSW_10_6_13/src/TauFW/PicoProducer/data/lepton/MuonPOG/Run2022postEE/muon_SFs_2022_postEE.root"
-
+        "muon_correction" : "/afs/cern.ch/user/s/stzakhar/work/run3_taufw/CMSSW_10_6_13/src/TauFW/PicoProducer/data/lepton/MuonPOG/Run2022postEE/muon_SFs_2022_postEE.root",
+        "tau_correction"  : "/afs/cern.ch/user/s/stzakhar/work/higgs_cp/data/corrections/tau/POG/TAU/2022_postEE/tau_DeepTau2018v2p5_2022_postEE.json.gz"
     })
 
+    # use local replicas of the external files when HIGGS_CP_EXTERNAL_REPLICAS is set
+    from higgs_cp.config.util import use_external_replicas
+    use_external_replicas(cfg)
+
     # target file size after MergeReducedEvents in MB
     cfg.x.reduced_file_size = 512.0
     
@@ -224,12 +244,19 @@ def add_run3_postEE(ana: od.Analysis,
     keep_columns(cfg)
 
     # event weight columns as keys in an OrderedDict, mapped to shift instances they depend on
-    #get_shifts = functools.partial(get_shifts_from_sources, cfg)
+    get_shifts = functools.partial(get_shifts_from_sources, cfg)
     cfg.x.event_weights = DotDict({
         "normalization_weight": [],
         "pu_weight": [],
         "muon_weight": [],
+        "tau_id_sf": get_shifts("tau_id"),
     })
+    # minimum bias cross section variations of the pileup weight, when their profiles are configured
+    from higgs_cp.config.util import add_minbias_xs_shifts
+    add_minbias_xs_shifts(cfg)
+    # let shifted event weights refer to the corresponding precomputed total weight
+    from higgs_cp.config.util import add_total_weight_aliases
+    add_total_weight_aliases(cfg)
 
     # versions per task family, either referring to strings or to callables receving the invoking
     # task instance and parameters to be passed to the task family
@@ -6,12 +6,20 @@ Config-related object definitions and utils.
 
 from __future__ import annotations
 
+import os
+import copy
 from typing import Callable, Any, Sequence
 
+import law
+import order as od
+from columnflow.util import DotDict
 from order import UniqueObject, TagMixin
 from order.util import typed
 
 
+logger = law.logger.get_logger(__name__)
+
+
 class TriggerLeg(object):
     """
     Container class storing information about trigger legs:
@@ -234,4 +242,176 @@ class Trigger(UniqueObject, TagMixin):
     @property
     def hlt_field(self):
         # remove the first four "HLT_" characters
-        return self.name[4:]
\ No newline at end of file
+        return self.name[4:]
+
+
+# defaults of the flags that switch between implementations of the selection and production steps
+# and enable their profiling, as well as of the sub-process ids of the tau flavour splits
+feature_flags = {
+    # engine used to build mu-tau pairs in mutau_selection, "awkward" (cartesian product of jagged
+    # records) or "numba" (single compiled pass over the flat Muon and Tau buffers)
+    "mutau_pair_builder": "awkward",
+    # how mu-tau pairs are resolved, "single" (only events with exactly one pair that passes the
+    # preselection) or "best" (best preselected pair per event, see select_from_multiple_pairs)
+    "mutau_pair_selection": "single",
+    # record time, peak memory and event counts of every step of the default selector
+    # in the selection stats under "selection_profile"
+    "selection_profiling": False,
+    # run the mu-tau pair selection, vetoes and trigger matching only on events that passed
+    # the trigger, jet veto and lepton selection steps, the final selection is unchanged
+    "selection_progressive": False,
+    # engine used to match trigger objects to the trigger legs in trigger_selection, "awkward"
+    # (jagged masks per leg) or "numba" (all legs in a single compiled pass over TrigObj)
+    "trigger_leg_matcher": "awkward",
+    # engine used to match the pair muon to the objects of the first trigger leg in
+    # trigger_matching, "awkward" (jagged delta R) or "numba" (single compiled pass over TrigObj
+    # using eta-phi cells, also storing the matches of all legs in the aux data)
+    "trigger_matching_engine": "awkward",
+    # additionally produce the muon trigger, ID and isolation scale factors and their uncertainties
+    # (muon_weight_<source>[_error]) as well as muon_weight_up/down
+    "muon_weight_sources": False,
+    # evaluate muon and tau weights only for the pair leptons (the first muon and tau after the
+    # reduction) and store them as flat per event columns
+    "lepton_weights_pair_only": False,
+    # edges of the muon isolation bins of the abcd regions, the first bin (below the first edge) is
+    # the isolated one and the following ones are sidebands, the last edge is inclusive
+    "abcd_iso_edges": (0.15, 0.30),
+    # insert the columns of the weight and feature producers at once at the end of the default
+    # producer instead of one by one, and log the memory allocated by the column writes per chunk
+    "producer_column_staging": False,
+    "producer_column_profiling": False,
+    # storage types of the product of all event weights (total_weight and its shifted versions) and
+    # of the matrix of the nominal weights per source, float16 (reduced precision), float32 or float64
+    "event_weight_dtypes": DotDict(total="float32", sources="float32"),
+    # sub-process ids assigned by the split_tau_flav producer per class of the pair tau, for datasets
+    # whose process names contain the key, e.g. "wj" for w+jets could be added in the same way
+    "tau_flav_splits": DotDict.wrap({
+        # mu->tau fakes and all other pairs in drell-yan samples
+        "dy": {"mu_fake": 51001, "e_fake": 51002, "genuine_tau": 51002, "jet_fake": 51002},
+    }),
+}
+
+
+def add_feature_flags(config: od.Config) -> None:
+    """
+    Sets the *feature_flags* in the auxiliary data of the *config*, each config obtaining its own
+    copy of the defaults.
+    """
+    for name, value in feature_flags.items():
+        config.set_aux(name, copy.deepcopy(value))
+
+
+def add_total_weight_aliases(config: od.Config) -> None:
+    """
+    Adds an alias of the total_weight column to the total_weight_<shift> column, written by the
+    total_weight producer, to all shifts that the weights in the *config*'s event_weights depend on.
+    """
+    for shift_insts in config.x.event_weights.values():
+        for shift_inst in shift_insts:
+            aliases = shift_inst.x("column_aliases", {})
+            aliases["total_weight"] = f"total_weight_{shift_inst.name}"
+            shift_inst.x.column_aliases = aliases
+
+
+def add_tau_id_shifts(config: od.Config) -> None:
+    """
+    Adds the tau_id_up/down shifts with aliases to the varied tau ID scale factors, which are all
+    produced in the same pass of the tau weight producer.
+    """
+    from columnflow.config_util import add_shift_aliases
+
+    config.add_shift(name="tau_id_up", id=12, type="shape")
+    config.add_shift(name="tau_id_down", id=13, type="shape")
+    add_shift_aliases(config, "tau_id", {"tau_id_sf": "tau_id_sf_{direction}"})
+
+
+def add_tes_shifts(config: od.Config) -> None:
+    """
+    Adds the tes_up/down shifts with aliases to the tau pt and mass for the varied tau energy scale,
+    which are all evaluated in the same pass of the tau_energy_scale calibrator, and to the visible
+    mass computed from them.
+    """
+    from columnflow.config_util import add_shift_aliases
+
+    config.add_shift(name="tes_up", id=14, type="shape")
+    config.add_shift(name="tes_down", id=15, type="shape")
+    add_shift_aliases(
+        config,
+        "tes",
+        {
+            "Tau.pt": "Tau.pt_tes_{direction}",
+            "Tau.mass": "Tau.mass_tes_{direction}",
+            "mutau_mass": "mutau_mass_tes_{direction}",
+        },
+    )
+
+
+def add_minbias_xs_shifts(config: od.Config) -> None:
+    """
+    Adds the minbias_xs_up/down shifts with aliases to the pileup weights for the varied minimum
+    bias cross section, produced by the pu_weight producer, and lets the pu_weight event weight
+    depend on them. Nothing is added unless both varied data pileup profiles are configured in
+    external_files.pileup as data_up and data_down, in which case a warning is logged.
+    """
+    from columnflow.config_util import add_shift_aliases, get_shifts_from_sources
+
+    pileup = config.x.external_files.pileup
+    if "data_up" not in pileup or "data_down" not in pileup:
+        logger.warning(
+            f"no varied data pileup profiles (data_up, data_down) configured in {config.name}, "
+            "minbias_xs shifts are not added",
+        )
+        return
+
+    config.add_shift(name="minbias_xs_up", id=7, type="shape")
+    config.add_shift(name="minbias_xs_down", id=8, type="shape")
+    add_shift_aliases(config, "minbias_xs", {"pu_weight": "pu_weight_minbias_xs_{direction}"})
+    if "pu_weight" in config.x.event_weights:
+        config.x.event_weights["pu_weight"] = get_shifts_from_sources(config, "minbias_xs")
+
+
+# external files with local replicas written by higgs_cp.benchmark.replicas
+replicated_external_files = ("pileup", "muon_correction", "tau_correction")
+
+
+def external_replica_paths(config: od.Config, directory: str) -> dict[str, str]:
+    """
+    Returns the paths of the local replicas of the *config*'s external files in
+    *replicated_external_files*, keyed by their dotted names in cfg.x.external_files, e.g.
+    ``pileup.data``. Replicas keep the file names of the originals and are placed in a
+    subdirectory of *directory* named after the config.
+    """
+    paths = {}
+
+    def add(key, value):
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                add(f"{key}.{sub_key}", sub_value)
+        else:
+            path = value[0] if isinstance(value, tuple) else value
+            paths[key] = os.path.join(os.path.expandvars(directory), config.name, os.path.basename(path))
+
+    for key in replicated_external_files:
+        if key in config.x.external_files:
+            add(key, config.x.external_files[key])
+    return paths
+
+
+def use_external_replicas(config: od.Config, directory: str | None = None) -> None:
+    """
+    Points the external files of the *config* in *replicated_external_files* to their local
+    replicas in *directory*, see :py:func:`external_replica_paths`, when *directory* is not empty.
+    It defaults to the HIGGS_CP_EXTERNAL_REPLICAS environment variable. The replicas are written
+    with scripts/make_external_replicas.py.
+    """
+    if directory is None:
+        directory = os.getenv("HIGGS_CP_EXTERNAL_REPLICAS", "")
+    if not directory:
+        return
+
+    for key, path in external_replica_paths(config, directory).items():
+        *parents, name = key.split(".")
+        files = config.x.external_files
+        for parent in parents:
+            files = files[parent]
+        files[name] = (path, files[name][1]) if isinstance(files[name], tuple) else path
@@ -30,7 +30,8 @@ def keep_columns(cfg: od.Config) -> None:
                 "pt","eta","phi","mass","dxy","dz", "charge", 
                 "rawDeepTau2018v2p5VSjet","idDeepTau2018v2p5VSjet", "idDeepTau2018v2p5VSe", "idDeepTau2018v2p5VSmu", 
                 "decayMode", "decayModePNet", "genPartFlav",
-                "pt_no_tes", "mass_no_tes"
+                "pt_no_tes", "mass_no_tes",
+                "pt_tes_up", "mass_tes_up", "pt_tes_down", "mass_tes_down",
                 ] 
         } | {f"Muon.{var}" for var in [
                 "pt","eta","phi","mass","dxy","dz", "charge", 
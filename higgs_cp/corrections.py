@@ -0,0 +1,105 @@
+# coding: utf-8
+
+"""
+Process-wide registry of correctionlib correction sets shared by calibrators and producers.
+"""
+
+from __future__ import annotations
+
+import os
+import gzip
+import time
+import hashlib
+
+import law
+
+from columnflow.util import maybe_import
+
+correctionlib = maybe_import("correctionlib")
+
+logger = law.logger.get_logger(__name__)
+
+# registered correction sets, mapped to (absolute path, size, modification time)
+_correction_sets = {}
+
+# whether Correction.__call__ was already aliased to Correction.evaluate
+_patched_call = False
+
+
+class RegisteredCorrectionSet(object):
+    """
+    Correction set parsed once from the file at *path* with content hash *digest*. Corrections
+    obtained with ``correction_set[name]`` are created once and then handed out again, so that all
+    users share the same ``Correction`` objects.
+    """
+
+    def __init__(self, path: str, digest: str, correction_set, load_time: float):
+        super().__init__()
+
+        self.path = path
+        self.digest = digest
+        self.correction_set = correction_set
+        self.load_time = load_time
+        self.n_hits = 0
+        self._corrections = {}
+
+    def __getitem__(self, name: str):
+        if name not in self._corrections:
+            self._corrections[name] = self.correction_set[name]
+        return self._corrections[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.correction_set
+
+
+def _patch_correction_call() -> None:
+    # allow calling corrections directly, done once per process
+    global _patched_call
+    if _patched_call:
+        return
+    correctionlib.highlevel.Correction.__call__ = correctionlib.highlevel.Correction.evaluate
+    _patched_call = True
+
+
+def load_correction_set(target: law.FileSystemFileTarget) -> RegisteredCorrectionSet:
+    """
+    Returns the correction set stored in the json file *target*, which may be gzipped. The file is
+    only read and parsed when no correction set with the same path, size and modification time was
+    loaded before in this process, otherwise the registered set is returned and counted as a hit.
+    """
+    _patch_correction_call()
+
+    path = os.path.abspath(target.abspath if hasattr(target, "abspath") else target.path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+
+    if key in _correction_sets:
+        entry = _correction_sets[key]
+        entry.n_hits += 1
+        logger.debug(f"reusing correction set {path} ({entry.n_hits} hits)")
+        return entry
+
+    t0 = time.perf_counter()
+    with target.open("rb") as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    # gzipped files are recognized by their magic bytes
+    content = gzip.decompress(raw) if raw[:2] == b"\x1f\x8b" else raw
+    correction_set = correctionlib.CorrectionSet.from_string(content.decode("utf-8"))
+    load_time = time.perf_counter() - t0
+
+    entry = _correction_sets[key] = RegisteredCorrectionSet(path, digest, correction_set, load_time)
+    logger.info(f"loaded correction set {path} in {load_time:.2f}s")
+    logger.debug(f"registered correction sets: {correction_registry_stats()}")
+    return entry
+
+
+def correction_registry_stats() -> dict:
+    """
+    Returns the load time in seconds and the number of cache hits per registered correction set,
+    keyed by path and the first characters of the content hash.
+    """
+    return {
+        f"{entry.path}@{entry.digest[:8]}": {"load_time": entry.load_time, "n_hits": entry.n_hits}
+        for entry in _correction_sets.values()
+    }
@@ -2,15 +2,18 @@
 Wrappers for some default sets of producers.
 """
 
+import tracemalloc
+
 from columnflow.production import Producer, producer
 from columnflow.util import maybe_import
 
 from columnflow.production.normalization import normalization_weights
 from columnflow.production.categories import category_ids
 from higgs_cp.production.example import features, cutflow_features 
-from higgs_cp.production.mutau_vars import dilepton_mass, mT, rel_charge
-from higgs_cp.production.weights import pu_weight, muon_weight, tau_weight
-from higgs_cp.production.sample_split import split_dy
+from higgs_cp.production.mutau_vars import dilepton_mass, mT, rel_charge, abcd_region
+from higgs_cp.production.weights import pu_weight, muon_weight, tau_weight, total_weight
+from higgs_cp.production.sample_split import split_tau_flav
+from higgs_cp.production.util import ColumnStage
 from higgs_cp.calibration.tau import tau_energy_scale
 ak = maybe_import("awkward")
 
@@ -36,27 +39,46 @@ pdgId_map = {
 
 @producer(
     uses={
-        rel_charge, category_ids, features, normalization_weights, cutflow_features, dilepton_mass, mT, pu_weight, muon_weight, tau_weight, split_dy
+        rel_charge, abcd_region, category_ids, features, normalization_weights, cutflow_features, dilepton_mass, mT, pu_weight, muon_weight, tau_weight, total_weight, split_tau_flav
     },
     produces={
-        rel_charge, category_ids, features, normalization_weights, cutflow_features, dilepton_mass, mT, pu_weight, muon_weight, tau_weight, split_dy
+        rel_charge, abcd_region, category_ids, features, normalization_weights, cutflow_features, dilepton_mass, mT, pu_weight, muon_weight, tau_weight, total_weight, split_tau_flav
     },
 )
 def default(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    #Columns that are not read by other producers are staged and inserted at once in the end
+    stage = ColumnStage(
+        enabled=self.config_inst.x("producer_column_staging", False),
+        profile=self.config_inst.x("producer_column_profiling", False),
+    )
+    # an outer trace, e.g. of a benchmark, is kept running
+    start_tracing = stage.profile and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
     events = self[rel_charge](events, **kwargs)
+    events = self[abcd_region](events, **kwargs)
     events = self[category_ids](events, **kwargs)
     if self.dataset_inst.is_mc:
         events = self[normalization_weights](events, **kwargs)
         # add corrected mc weights
         processes = self.dataset_inst.processes.names()
-        if ak.any(['dy' in proc for proc in processes]):
-            print("Splitting Drell-Yan dataset...")
-            events = self[split_dy](events, **kwargs)
-        events = self[pu_weight](events, **kwargs)
-        events = self[muon_weight](events, **kwargs)
-        events = self[tau_weight](events, **kwargs) 
+        for split in self.config_inst.x.tau_flav_splits:
+            if ak.any([split in proc for proc in processes]):
+                print(f"Splitting {split} dataset...")
+                events = self[split_tau_flav](events, split=split, **kwargs)
+        events = self[pu_weight](events, stage=stage, **kwargs)
+        events = self[muon_weight](events, stage=stage, **kwargs)
+        events = self[tau_weight](events, stage=stage, **kwargs) 
            
     # features
-    events = self[dilepton_mass](events, **kwargs)
-    events = self[mT](events, **kwargs)
-    return events
\ No newline at end of file
+    events = self[dilepton_mass](events, stage=stage, **kwargs)
+    events = self[mT](events, stage=stage, **kwargs)
+    events = stage.flush(events)
+    if self.dataset_inst.is_mc:
+        # product of all event weights, after the staged weights were inserted
+        events = self[total_weight](events, **kwargs)
+    if start_tracing:
+        tracemalloc.stop()
+    if stage.profile:
+        stage.report()
+    return events
@@ -0,0 +1,73 @@
+# coding: utf-8
+
+"""
+Kinematic quantities of the mu-tau pair computed on the raw pt, eta, phi and mass columns, without
+attaching coffea behavior to the events.
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import
+from columnflow.columnar_util import EMPTY_FLOAT, flat_np_view
+from higgs_cp.util import jit, first_flat_index
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+def delta_phi(phi1: np.ndarray, phi2: np.ndarray) -> np.ndarray:
+    """
+    Returns the difference *phi1* - *phi2* of flat arrays, wrapped into [-pi, pi), in the same way
+    as ``delta_phi`` of the coffea vector behavior.
+    """
+    return (phi1 - phi2 + np.pi) % (2 * np.pi) - np.pi
+
+
+def transverse_mass(pt1: np.ndarray, phi1: np.ndarray, pt2: np.ndarray, phi2: np.ndarray) -> np.ndarray:
+    """
+    Returns the transverse mass of two massless objects given as flat arrays.
+    """
+    return np.sqrt(2 * pt1 * pt2 * (1 - np.cos(delta_phi(phi1, phi2))))
+
+
+def _visible_mass(mu_pt, mu_eta, mu_phi, mu_mass, tau_eta, tau_phi, tau_pt, tau_mass, mass):
+    # numba kernel, compiled on first use via higgs_cp.util.jit
+    # m^2 = m1^2 + m2^2 + 2 * (E1 * E2 - pt1 * pt2 * (cos(dphi) + sinh(eta1) * sinh(eta2)))
+    for i in range(len(mu_pt)):
+        mu_p = mu_pt[i] * np.cosh(mu_eta[i])
+        mu_e = np.sqrt(mu_p * mu_p + mu_mass[i] * mu_mass[i])
+        tau_cosh = np.cosh(tau_eta[i])
+        angle = np.cos(mu_phi[i] - tau_phi[i]) + np.sinh(mu_eta[i]) * np.sinh(tau_eta[i])
+        for v in range(tau_pt.shape[0]):
+            tau_p = tau_pt[v, i] * tau_cosh
+            tau_e = np.sqrt(tau_p * tau_p + tau_mass[v, i] * tau_mass[v, i])
+            mass2 = (mu_mass[i] * mu_mass[i] + tau_mass[v, i] * tau_mass[v, i] +
+                     2 * (mu_e * tau_e - mu_pt[i] * tau_pt[v, i] * angle))
+            mass[v, i] = np.sqrt(mass2) if mass2 >= 0 else EMPTY_FLOAT
+
+
+def visible_mass(muon: ak.Array, tau: ak.Array, variants: list) -> np.ndarray:
+    """
+    Computes the visible mass of the first *muon* and the first *tau* per event in closed form on
+    the flat buffers, for all tau pt and mass *variants* at once, e.g. ``["", "_no_tes"]`` for
+    ``Tau.pt`` and ``Tau.pt_no_tes``. Returns a float32 array of shape (variants, events) that is
+    *EMPTY_FLOAT* for events without a muon or tau.
+    """
+    has_mu, mu_idx = first_flat_index(muon.pt)
+    has_tau, tau_idx = first_flat_index(tau.pt)
+    has_pair = has_mu & has_tau
+    mu_idx = mu_idx[has_tau[has_mu]]
+    tau_idx = tau_idx[has_mu[has_tau]]
+    flat = lambda array, idx: flat_np_view(array, axis=1)[idx].astype(np.float64)
+    pair_mass = np.empty((len(variants), len(mu_idx)), dtype=np.float32)
+    jit(_visible_mass)(
+        flat(muon.pt, mu_idx), flat(muon.eta, mu_idx), flat(muon.phi, mu_idx), flat(muon.mass, mu_idx),
+        flat(tau.eta, tau_idx), flat(tau.phi, tau_idx),
+        np.stack([flat(tau[f"pt{var}"], tau_idx) for var in variants]),
+        np.stack([flat(tau[f"mass{var}"], tau_idx) for var in variants]),
+        pair_mass,
+    )
+    mass = np.full((len(variants), len(has_pair)), EMPTY_FLOAT, dtype=np.float32)
+    mass[:, has_pair] = pair_mass
+    return mass
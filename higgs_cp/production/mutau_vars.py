@@ -1,8 +1,12 @@
+from __future__ import annotations
+
 import functools
 from columnflow.production import Producer, producer
 from columnflow.util import maybe_import
-from columnflow.columnar_util import set_ak_column, EMPTY_FLOAT, Route, optional_column as optional
-from columnflow.production.util import attach_coffea_behavior
+from columnflow.columnar_util import set_ak_column, has_ak_column, EMPTY_FLOAT, Route, flat_np_view, optional_column as optional
+from higgs_cp.util import flat_content, jagged_from_offsets, first_flat_index
+from higgs_cp.production.kinematics import visible_mass, transverse_mass
+from higgs_cp.production.util import ColumnStage, stage_column
 #from IPython import embed
 ak = maybe_import("awkward")
 np = maybe_import("numpy")
@@ -10,41 +14,35 @@ coffea = maybe_import("coffea")
 # helper
 set_ak_column_f32 = functools.partial(set_ak_column, value_type=np.float32)
 
+# tau pt and mass variants for which the visible mass is computed, nominal values first
+tau_variants = ["", "_no_tes", "_tes_up", "_tes_down"]
+
+
 @producer(
     uses = 
     {
         f"Muon.{var}" for var in ["pt", "eta","phi", "mass","charge"]
     } | {
         f"Tau.{var}" for var in ["pt","eta","phi", "mass", "dxy", "dz", "charge"] 
-    } | {optional("Tau.pt_no_tes"), optional("Tau.mass_no_tes")
-    } | {attach_coffea_behavior},
+    } | {
+        optional(f"Tau.{var}{tag}") for var in ["pt", "mass"] for tag in tau_variants[1:]
+    },
     produces={
-        "mutau_mass_no_tes", "mutau_mass"
+        f"mutau_mass{tag}" for tag in tau_variants
     },
 )
-def dilepton_mass(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+def dilepton_mass(self: Producer, events: ak.Array, stage: ColumnStage | None = None, **kwargs) -> ak.Array:
     print("Producing dilepton mass...")
-    from coffea.nanoevents.methods import vector
-    events = self[attach_coffea_behavior](events, **kwargs)
-    muon = ak.firsts(events.Muon, axis=1)
-    if self.dataset_inst.is_mc: tags = ["", "_no_tes"]
+    #Variants other than the nominal one only exist in simulation, and the events of a tes shift
+    #lack the variant of the shift, whose values were aliased to Tau.pt and Tau.mass upstream
+    if self.dataset_inst.is_mc: tags = [tag for tag in tau_variants if not tag or has_ak_column(events, f"Tau.pt{tag}")]
     else: tags = [""]
-    for tag in tags:
-        tau = ak.zip(
-            {
-                "pt": events.Tau[f"pt{tag}"],
-                "eta": events.Tau.eta,
-                "phi": events.Tau.phi,
-                "mass": events.Tau[f"mass{tag}"],
-            },
-            with_name="PtEtaPhiMLorentzVector",
-            behavior=vector.behavior,
-        )
-        mutau_obj = muon + tau
-        mutau_mass = ak.flatten(ak.where(mutau_obj.mass2 >=0, mutau_obj.mass, EMPTY_FLOAT))
-        events = set_ak_column_f32(events,f"mutau_mass{tag}",mutau_mass)
-    if self.dataset_inst.is_data:
-        events = set_ak_column_f32(events,f"mutau_mass_no_tes",mutau_mass)
+    mutau_mass = visible_mass(events.Muon, events.Tau, tags)
+    for tag, mass in zip(tags, mutau_mass):
+        events = stage_column(events,f"mutau_mass{tag}",mass,stage,value_type=np.float32)
+    for tag in tau_variants:
+        if tag not in tags:
+            events = stage_column(events,f"mutau_mass{tag}",mutau_mass[0],stage,value_type=np.float32)
     return events
 
 
@@ -52,42 +50,70 @@ def dilepton_mass(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
     uses = 
     {
         f"{lep}.charge" for lep in
-        [ "Electron", "Muon", "Tau"]    
-    } | {attach_coffea_behavior},
+        [ "Muon", "Tau"]    
+    },
     produces={
         "rel_charge"
     },
 )
 def rel_charge(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
     print("Producing  pair relative charge...")
-    events = self[attach_coffea_behavior](events, **kwargs)
-    # get channels from the config
-    channels = self.config_inst.channels.keys()
-    lep1_charge = ak.firsts(events.Tau.charge, axis=1)
-    lep2_charge = ak.zeros_like(events.Tau.charge, axis=1)
-    events = set_ak_column_f32(events,f"rel_charge", lep1_charge * lep2_charge)
+    #After the reduction, the muon and tau collections only hold the selected pair, so the pair
+    #charges are the ones of the first objects, events without a pair get a relative charge of zero
+    has_mu, mu_idx = first_flat_index(events.Muon.charge)
+    has_tau, tau_idx = first_flat_index(events.Tau.charge)
+    mu_charge = np.zeros(len(events), dtype=np.int8)
+    tau_charge = np.zeros(len(events), dtype=np.int8)
+    mu_charge[has_mu] = flat_np_view(events.Muon.charge, axis=1)[mu_idx]
+    tau_charge[has_tau] = flat_np_view(events.Tau.charge, axis=1)[tau_idx]
+    events = set_ak_column(events, "rel_charge", mu_charge * tau_charge, value_type=np.int8)
+    return events
+
+@producer(
+    uses = 
+    {
+        "rel_charge", "Muon.pfRelIso04_all",
+    },
+    produces={
+        "abcd_region"
+    },
+)
+def abcd_region(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    #Isolation of the pair muon, binned once against all edges, events without a pair muon, with
+    #an isolation above the last edge or without a charged pair get a code of -1, see
+    #higgs_cp.util.abcd_regions for the codes of the categories
+    edges = np.asarray(self.config_inst.x.abcd_iso_edges, dtype=np.float32)
+    has_mu, mu_idx = first_flat_index(events.Muon.pfRelIso04_all)
+    iso = np.full(len(events), np.inf, dtype=np.float32)
+    iso[has_mu] = flat_np_view(events.Muon.pfRelIso04_all, axis=1)[mu_idx]
+    iso_bin = np.searchsorted(edges, iso, side="right")
+    iso_bin[iso == edges[-1]] = len(edges) - 1
+    rel_charge = np.asarray(events.rel_charge)
+    region = 2 * iso_bin + (rel_charge > 0)
+    region[(iso_bin >= len(edges)) | (rel_charge == 0)] = -1
+    events = set_ak_column(events, "abcd_region", region, value_type=np.int8)
     return events
 
+
 @producer(
     uses = 
     {
         f"Muon.{var}" for var in ["pt","phi"]
     } | {
         f"PuppiMET.{var}" for var in ["pt","phi"] 
-    } | {attach_coffea_behavior},
+    },
     produces={
         "Muon.mT"
     },
 )
-def mT(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+def mT(self: Producer, events: ak.Array, stage: ColumnStage | None = None, **kwargs) -> ak.Array:
     print("producing mT...")
-    events = self[attach_coffea_behavior](events, **kwargs)
-    cos_dphi = np.cos(events.Muon.delta_phi(events.PuppiMET))
-    mT_values = np.sqrt(2 * events.Muon.pt * events.PuppiMET.pt * (1 - cos_dphi))
-    mT_values = ak.fill_none(mT_values, EMPTY_FLOAT)
-    events = set_ak_column_f32(events, Route("Muon.mT"), mT_values)
+    #Work on the flat muon content, the MET is repeated for each muon of the event
+    offsets, mu_pt = flat_content(events.Muon.pt)
+    _, mu_phi = flat_content(events.Muon.phi)
+    counts = np.diff(np.asarray(offsets))
+    met_pt = np.repeat(np.asarray(events.PuppiMET.pt), counts)
+    met_phi = np.repeat(np.asarray(events.PuppiMET.phi), counts)
+    mT_values = transverse_mass(mu_pt, mu_phi, met_pt, met_phi)
+    events = stage_column(events, Route("Muon.mT"), jagged_from_offsets(offsets, mT_values), stage, value_type=np.float32)
     return events
-    
-
-    
-   
\ No newline at end of file
@@ -3,6 +3,7 @@ from columnflow.production import Producer, producer
 from columnflow.util import maybe_import, safe_div, InsertableDict
 from columnflow.columnar_util import set_ak_column,remove_ak_column, has_ak_column, EMPTY_FLOAT, Route, flat_np_view, optional_column as optional
 from columnflow.production.util import attach_coffea_behavior
+from higgs_cp.util import first_flat_index
 
 ak     = maybe_import("awkward")
 np     = maybe_import("numpy")
@@ -11,36 +12,49 @@ coffea = maybe_import("coffea")
 set_ak_column_f32 = functools.partial(set_ak_column, value_type=np.float32)
 
 
+# classes of the pair tau by the origin of the reconstructed tau, mapped to genPartFlav values
+# 0: unmatched (jet), 1: prompt e, 2: prompt mu, 3: tau->e, 4: tau->mu, 5: tau_had
+tau_flav_classes = {
+    "jet_fake"      : (0,),
+    "e_fake"        : (1,),
+    "mu_fake"       : (2,),
+    "genuine_tau"   : (3, 4, 5),
+}
+
+
 @producer(
-    uses={f"Tau.{var}" for var in [
-                "decayMode", "genPartFlav"
-                ] 
-    } | {"process_id"},
+    uses={"Tau.genPartFlav", "process_id"},
     produces={
         "process_id"
     },
     mc_only=True,
 )
-def split_dy(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
-  
-    dm = flat_np_view(events.Tau.decayMode, axis=1)
-    match = flat_np_view(events.Tau.genPartFlav, axis=1)
+def split_tau_flav(self: Producer, events: ak.Array, split: str = "dy", **kwargs) -> ak.Array:
+    """
+    Assigns the sub-process ids of the *split* defined in cfg.x.tau_flav_splits to all events,
+    based on the class of the pair tau, i.e. the first tau after the reduction. Events without
+    tau keep their process id.
+    """
+    #Reduce the pair tau to one genPartFlav per event and look up the sub-process id
+    has_tau, tau_idx = first_flat_index(events.Tau.genPartFlav)
+    match = flat_np_view(events.Tau.genPartFlav, axis=1)[tau_idx]
     process_id = np.array(events.process_id)
-   
-    tau_part_flav = {
-        "prompt_e"  : 1,
-        "prompt_mu" : 2,
-        "tau->e"    : 3,
-        "tau->mu"   : 4,
-        "tau_had"   : 5
-    }
-    mu2tau_fakes_mask = (match == tau_part_flav["prompt_mu"])
-    mu_tau_fake_id = 51001*ak.ones_like(events.process_id) 
-    mu_tau_gen_id = 51002*ak.ones_like(events.process_id) 
-    process_id[mu2tau_fakes_mask] = mu_tau_fake_id[mu2tau_fakes_mask]
-    process_id[~mu2tau_fakes_mask] = mu_tau_gen_id[~mu2tau_fakes_mask]
+    process_id[has_tau] = self.split_tables[split][match]
     events = remove_ak_column(events, "process_id")
     events = set_ak_column(events, "process_id", process_id, value_type=np.int32)
     return events
 
-
+@split_tau_flav.setup
+def split_tau_flav_setup(
+    self: Producer,
+    reqs: dict,
+    inputs: dict,
+    reader_targets: InsertableDict,
+) -> None:
+    #Sub-process id per genPartFlav value for each configured split
+    self.split_tables = {}
+    for split, process_ids in self.config_inst.x.tau_flav_splits.items():
+        table = np.zeros(256, dtype=np.int64)
+        for tau_class, flavs in tau_flav_classes.items():
+            table[list(flavs)] = process_ids[tau_class]
+        self.split_tables[split] = table
@@ -0,0 +1,147 @@
+# coding: utf-8
+
+"""
+Helpers shared between producers.
+"""
+
+from __future__ import annotations
+
+import tracemalloc
+import contextlib
+
+import law
+
+from columnflow.util import maybe_import
+from columnflow.columnar_util import Route, set_ak_column
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+logger = law.logger.get_logger(__name__)
+
+
+class ColumnStage(object):
+    """
+    Collects new columns of several producers and inserts them into the events at once, instead of
+    rebuilding the event record with every ``set_ak_column`` call. Producers write their columns
+    through :py:func:`stage_column` and the caller inserts them with :py:meth:`flush`:
+
+    .. code-block:: python
+
+        stage = ColumnStage(enabled=True)
+        events = self[pu_weight](events, stage=stage, **kwargs)
+        events = self[muon_weight](events, stage=stage, **kwargs)
+        events = stage.flush(events)
+
+    Staged columns are not visible in the events before the flush, so only columns that are not
+    read by subsequent producers should be staged. When *enabled* is *False*, columns are set
+    immediately. When *profile* is *True* and tracemalloc is tracing, the memory allocated while
+    setting columns is added to :py:attr:`n_bytes` in both modes.
+    """
+
+    def __init__(self, enabled: bool = True, profile: bool = False):
+        super().__init__()
+
+        self.enabled = enabled
+        self.profile = profile
+        self.columns = {}
+        self.n_columns = 0
+        self.n_bytes = 0
+
+    @contextlib.contextmanager
+    def _measure(self):
+        if not self.profile or not tracemalloc.is_tracing():
+            yield
+            return
+
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        yield
+        _, peak = tracemalloc.get_traced_memory()
+        self.n_bytes += peak - current
+
+    def set(self, events: ak.Array, route: Route | str, value, value_type=None) -> ak.Array:
+        """
+        Stages the column *route* with *value*, optionally cast to *value_type*, and returns the
+        *events* unchanged, or sets it in the *events* right away when the stage is disabled.
+        """
+        self.n_columns += 1
+        with self._measure():
+            if not self.enabled:
+                return set_ak_column(events, route, value, value_type=value_type)
+            if value_type:
+                value = ak.values_astype(value, value_type)
+            self.columns[Route(route)] = value
+        return events
+
+    def flush(self, events: ak.Array) -> ak.Array:
+        """
+        Inserts all staged columns into the *events*, rebuilding the event record and each nested
+        collection with new columns only once, and returns the new events.
+        """
+        if not self.columns:
+            return events
+
+        with self._measure():
+            layout = ak.to_layout(events)
+            if not isinstance(layout, ak.contents.RecordArray):
+                # no plain record, e.g. after masking, so set the columns one by one
+                for route, value in self.columns.items():
+                    events = set_ak_column(events, route, value)
+            else:
+                contents = dict(zip(layout.fields, layout.contents))
+                collections = {}
+                missing = {}
+                for route, value in self.columns.items():
+                    if len(route) == 1:
+                        contents[route.fields[0]] = ak.to_layout(value)
+                    elif route[0] in contents:
+                        collections.setdefault(route[0], []).append((route[1:], value))
+                    else:
+                        missing[route] = value
+                for name, columns in collections.items():
+                    collection = events[name]
+                    for sub_route, value in columns:
+                        collection = set_ak_column(collection, sub_route, value)
+                    contents[name] = ak.to_layout(collection)
+                events = ak.Array(
+                    ak.contents.RecordArray(
+                        list(contents.values()),
+                        list(contents.keys()),
+                        length=layout.length,
+                        parameters=layout.parameters,
+                    ),
+                    behavior=events.behavior,
+                )
+                # columns of new collections are created by set_ak_column
+                for route, value in missing.items():
+                    events = set_ak_column(events, route, value)
+        self.columns.clear()
+        return events
+
+    def report(self) -> None:
+        """
+        Logs the number of columns set and, when profiled, the memory allocated for them.
+        """
+        mode = "staged" if self.enabled else "sequential"
+        msg = f"{mode} column writes: {self.n_columns} columns"
+        if self.profile:
+            msg += f", {self.n_bytes / 1024**2:.1f} MB allocated"
+        logger.info(msg)
+
+
+def stage_column(
+    events: ak.Array,
+    route: Route | str,
+    value,
+    stage: ColumnStage | None = None,
+    value_type=None,
+) -> ak.Array:
+    """
+    Sets the column *route* in the *events* via the *stage* when given, see :py:class:`ColumnStage`,
+    and with ``set_ak_column`` otherwise.
+    """
+    if stage is None:
+        return set_ak_column(events, route, value, value_type=value_type)
+    return stage.set(events, route, value, value_type=value_type)
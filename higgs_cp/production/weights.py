@@ -1,15 +1,120 @@
+from __future__ import annotations
+
+import os
+import hashlib
+import tempfile
 import functools
+
+import law
+
 from columnflow.production import Producer, producer
-from columnflow.util import maybe_import, safe_div, InsertableDict
+from columnflow.util import DotDict, maybe_import, safe_div, InsertableDict
 from columnflow.columnar_util import set_ak_column, has_ak_column, EMPTY_FLOAT, Route, flat_np_view, optional_column as optional
 from columnflow.production.util import attach_coffea_behavior
+from higgs_cp.corrections import load_correction_set
+from higgs_cp.production.util import ColumnStage, stage_column
+from higgs_cp.util import flat_content, jagged_from_offsets, first_flat_index, offsets_from_counts
 
 ak     = maybe_import("awkward")
 np     = maybe_import("numpy")
 coffea = maybe_import("coffea")
+logger = law.logger.get_logger(__name__)
 # helper
 set_ak_column_f32 = functools.partial(set_ak_column, value_type=np.float32)
 
+def build_pileup_table(data_fnames: list[str], mc_fname: str, hist_name: str = "pileup") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Builds a lookup table of pileup weights from the histograms *hist_name* in the data pileup
+    files *data_fnames*, e.g. for the nominal and varied minimum bias cross sections, and in the mc
+    pileup file. The table is defined on the union of the bin edges of all histograms and holds
+    the normalised data/mc ratio per data profile and bin, or zero where the mc histogram is
+    empty. Values outside the edges are assigned to the first or last bin. As before, each data
+    profile is normalised by the ratio of the mc and data histograms summed over their values at
+    the integers 0 to 999.
+
+    Returns the edges and the weights of shape (data profiles, bins), to be looked up with
+    :py:func:`lookup_pileup_table`.
+    """
+    import uproot
+    hists = []
+    for fname in [mc_fname, *data_fnames]:
+        with uproot.open(fname) as f:
+            hist = f[hist_name]
+            hists.append((hist.values(), hist.axis().edges()))
+
+    def evaluate(values, edges, x):
+        # bin lookup identical to coffea's dense_lookup
+        return values[np.clip(np.searchsorted(edges, x, side="right") - 1, 0, len(values) - 1)]
+
+    def integral(values, edges):
+        # sum over the integers 0 to 999, summed sequentially in double precision
+        return np.cumsum(evaluate(values, edges, np.arange(1000)).astype(np.float64))[-1]
+
+    # all histograms are constant within each bin of the union of their edges
+    edges = functools.reduce(np.union1d, [hist_edges for _, hist_edges in hists])
+    (mc_values, mc_edges), data_hists = hists[0], hists[1:]
+    mc_integral = integral(mc_values, mc_edges)
+    mc_weight = evaluate(mc_values, mc_edges, edges[:-1])
+
+    weights = []
+    for data_values, data_edges in data_hists:
+        mc2data_norm = safe_div(mc_integral, integral(data_values, data_edges))
+        data_weight = evaluate(data_values, data_edges, edges[:-1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights.append(np.where(mc_weight != 0, data_weight / mc_weight * mc2data_norm, 0))
+    return edges, np.stack(weights)
+
+
+def pileup_table_dir() -> str:
+    """
+    Returns the directory of the cached pileup weight tables, in the software directory of
+    columnflow when set up, or in the temporary directory otherwise.
+    """
+    base = os.getenv("CF_SOFTWARE_BASE")
+    if base:
+        return os.path.join(base, "tmp", "pu_tables")
+    return os.path.join(tempfile.gettempdir(), "higgs_cp_pu_tables")
+
+
+def load_pileup_table(data_fnames: list[str], mc_fname: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the pileup weight table of :py:func:`build_pileup_table`. The table is stored in a
+    ``.npz`` file in :py:func:`pileup_table_dir`, named after the hash of the absolute paths,
+    sizes and modification times of all input files, and read from there as long as these are
+    unchanged, so that the ROOT files are only read once. When the directory is not writable, the
+    table is rebuilt.
+    """
+    digest = hashlib.sha1()
+    for fname in [*data_fnames, mc_fname]:
+        stat = os.stat(fname)
+        digest.update(f"{os.path.abspath(fname)}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    table_fname = os.path.join(pileup_table_dir(), f"{digest.hexdigest()}.pu_table.npz")
+
+    if os.path.exists(table_fname):
+        with np.load(table_fname) as table:
+            return table["edges"], table["weights"]
+
+    edges, weights = build_pileup_table(data_fnames, mc_fname)
+    try:
+        # write to a temporary file first so that concurrent jobs never read a partial table
+        os.makedirs(os.path.dirname(table_fname), exist_ok=True)
+        tmp_fname = f"{table_fname}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_fname, edges=edges, weights=weights)
+        os.replace(tmp_fname, table_fname)
+    except OSError as e:
+        logger.warning(f"could not store pileup weight table {table_fname}: {e}")
+    return edges, weights
+
+
+def lookup_pileup_table(edges: np.ndarray, weights: np.ndarray, n_true_int: np.ndarray) -> np.ndarray:
+    """
+    Looks up the pileup *weights* for *n_true_int* in a table with bin *edges*, for all data
+    profiles at once when *weights* is stacked.
+    """
+    idx = np.clip(np.searchsorted(edges, n_true_int, side="right") - 1, 0, weights.shape[-1] - 1)
+    return weights[..., idx]
+
+
 @producer(
     uses={
         "Pileup.nTrueInt"
@@ -19,15 +124,24 @@ set_ak_column_f32 = functools.partial(set_ak_column, value_type=np.float32)
     },
     mc_only=True,
 )
-def pu_weight(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
-    nTrueInt = events.Pileup.nTrueInt
-    pu_weight = ak.where (self.mc_weight(nTrueInt) != 0,
-                          self.data_weight(nTrueInt)/self.mc_weight(nTrueInt) * self.mc2data_norm,
-                          0)
+def pu_weight(self: Producer, events: ak.Array, stage: ColumnStage | None = None, **kwargs) -> ak.Array:
+    #Single lookup of the nominal and varied weights in the table built in the setup
+    pu_weights = lookup_pileup_table(self.pu_edges, self.pu_weights, np.asarray(events.Pileup.nTrueInt))
     
-    events = set_ak_column_f32(events, "pu_weight", pu_weight)
+    for column, weight in zip(self.pu_columns, pu_weights):
+        events = stage_column(events, column, weight, stage, value_type=np.float32)
     return events
 
+@pu_weight.init
+def pu_weight_init(self: Producer) -> None:
+    #Variations of the minimum bias cross section are produced when their data profiles are configured
+    pileup = self.config_inst.x.external_files.pileup
+    self.pu_files = {"pu_weight": pileup.data}
+    if "data_up" in pileup and "data_down" in pileup:
+        self.pu_files["pu_weight_minbias_xs_up"] = pileup.data_up
+        self.pu_files["pu_weight_minbias_xs_down"] = pileup.data_down
+    self.produces |= set(self.pu_files)
+
 @pu_weight.setup
 def pu_weight_setup(
     self: Producer,
@@ -36,29 +150,12 @@ def pu_weight_setup(
     reader_targets: InsertableDict,
 ) -> None:
     """
-    Loads the pileup weights added through the requirements and saves them in the
-    py:attr:`pu_weight` attribute for simpler access in the actual callable.
-    """
-    from coffea.lookup_tools import extractor
-    ext = extractor()
-    data_full_fname = self.config_inst.x.external_files.pileup.data
-    data_name = data_full_fname.split('/')[-1].split('.')[0]
-    mc_full_fname = self.config_inst.x.external_files.pileup.mc
-    mc_name = mc_full_fname.split('/')[-1].split('.')[0]
-    ext.add_weight_sets([f'{data_name} pileup {data_full_fname}', f'{mc_name} pileup {mc_full_fname}' ])
-    ext.finalize()
-    
-    self.evaluator = ext.make_evaluator()
-    
-    mc_integral = 0.
-    data_integral = 0.
-    for npu in range(0,1000):
-        mc_integral += self.evaluator[mc_name](npu)
-        data_integral += self.evaluator[data_name](npu)
-    
-    self.mc_weight = self.evaluator[mc_name]
-    self.data_weight = self.evaluator[data_name] 
-    self.mc2data_norm = safe_div(mc_integral,data_integral)
+    Loads the table of pileup weights built from the nominal and varied data pileup histograms and
+    the mc pileup histogram in the config, see :py:func:`load_pileup_table`.
+    """
+    self.pu_columns = list(self.pu_files)
+    self.pu_edges, self.pu_weights = load_pileup_table(list(self.pu_files.values()),
+                                                       self.config_inst.x.external_files.pileup.mc)
 
 
 @producer(
@@ -90,6 +187,58 @@ def get_mc_weight(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
 
     return events
 
+def build_binned_sf_table(fname: str, hist_names: dict[str, str]) -> tuple[tuple[np.ndarray, np.ndarray], DotDict]:
+    """
+    Reads the two-dimensional scale factor histograms *hist_names*, mapping source names to
+    histogram names in the ROOT file *fname*, and merges them on the union of their bin edges per
+    axis. Values outside the edges are assigned to the first or last bin, as in coffea's
+    dense_lookup.
+
+    Returns the edges per axis and a DotDict with the per bin factor of each source and its
+    uncertainty (``<source>_error``, the square root of the histogram variances), to be looked up
+    with :py:func:`lookup_binned_table`.
+    """
+    import uproot
+    hists = {}
+    with uproot.open(fname) as f:
+        for source, hist_name in hist_names.items():
+            hist = f[hist_name]
+            hists[source] = (hist.values(), np.sqrt(hist.variances()), [ax.edges() for ax in hist.axes])
+
+    # all histograms are constant within each bin of the union of their edges
+    edges = tuple(
+        functools.reduce(np.union1d, [hist_edges[axis] for _, _, hist_edges in hists.values()])
+        for axis in range(2)
+    )
+    table = DotDict()
+    for source, (values, errors, hist_edges) in hists.items():
+        idx = np.ix_(*[
+            np.clip(np.searchsorted(hist_edges[axis], edges[axis][:-1], side="right") - 1,
+                    0, values.shape[axis] - 1)
+            for axis in range(2)
+        ])
+        table[source] = values[idx]
+        table[f"{source}_error"] = errors[idx]
+    return edges, table
+
+
+def lookup_binned_table(edges: tuple[np.ndarray, np.ndarray], values: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Looks up flat *x* and *y* in a table with bin *edges* per axis. The bin index is computed once
+    and used for all tables stacked in the leading dimensions of *values*.
+    """
+    ix = np.clip(np.searchsorted(edges[0], x, side="right") - 1, 0, len(edges[0]) - 2)
+    iy = np.clip(np.searchsorted(edges[1], y, side="right") - 1, 0, len(edges[1]) - 2)
+    return values.reshape(*values.shape[:-2], -1)[..., ix * (len(edges[1]) - 1) + iy]
+
+
+# names of the muon scale factor histograms per source
+muon_sf_hists = {
+    "trig": "ScaleFactor_trg",
+    "id": "ScaleFactor_id",
+    "iso": "ScaleFactor_iso",
+}
+
 @producer(
     uses={
         "Muon.pt", "Muon.eta"
@@ -99,13 +248,37 @@ def get_mc_weight(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
     },
     mc_only=True,
 )
-def muon_weight(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
-    
-    muon_weight = self.muon_sf(self, events.Muon.pt, events.Muon.eta)
-    events = set_ak_column(events, "muon_weight", muon_weight, value_type=np.float32)
+def muon_weight(self: Producer, events: ak.Array, stage: ColumnStage | None = None, **kwargs) -> ak.Array:
+    #All columns are looked up at once in the fused table built in the setup
+    offsets, pt = flat_content(events.Muon.pt)
+    _, eta = flat_content(events.Muon.eta)
+    if self.config_inst.x("lepton_weights_pair_only", False):
+        #Only the pair muon, i.e. the first muon after the reduction, flat weights per event
+        has_muon, idx = first_flat_index(events.Muon.pt)
+        weights = np.ones((len(self.muon_sf_columns), len(events)), dtype=np.float32)
+        weights[:, has_muon] = lookup_binned_table(self.muon_sf_edges, self.muon_sf_values, pt[idx], eta[idx])
+        for column, weight in zip(self.muon_sf_columns, weights):
+            events = stage_column(events, column, weight, stage, value_type=np.float32)
+        return events
+
+    weights = lookup_binned_table(self.muon_sf_edges, self.muon_sf_values, pt, eta)
+    for column, weight in zip(self.muon_sf_columns, weights):
+        events = stage_column(events, column, jagged_from_offsets(offsets, weight), stage, value_type=np.float32)
 
     return events
 
+@muon_weight.init
+def muon_weight_init(self: Producer) -> None:
+    #Per source factors, their uncertainties and the total up and down variations are optional
+    self.muon_sf_columns = ["muon_weight"]
+    if self.config_inst.x("muon_weight_sources", False):
+        self.muon_sf_columns += [
+            f"muon_weight_{source}{postfix}"
+            for source in muon_sf_hists
+            for postfix in ["", "_error"]
+        ] + ["muon_weight_up", "muon_weight_down"]
+    self.produces |= set(self.muon_sf_columns)
+
 @muon_weight.setup
 def muon_weight_setup(
     self: Producer,
@@ -113,15 +286,33 @@ def muon_weight_setup(
     inputs: dict,
     reader_targets: InsertableDict,
 ) -> None:
-    from coffea.lookup_tools import extractor
-    ext = extractor()
+    """
+    Merges the trigger, ID and isolation scale factor histograms into one table of all produced
+    columns, with the product of the three factors as ``muon_weight``. The up and down variations
+    shift all factors coherently by their uncertainties.
+    """
     full_fname = self.config_inst.x.external_files.muon_correction
-    ext.add_weight_sets([f'sf_trig ScaleFactor_trg {full_fname}',
-                         f'sf_id ScaleFactor_id {full_fname}',
-                         f'sf_iso ScaleFactor_iso {full_fname}'])
-    ext.finalize()
-    self.evaluator = ext.make_evaluator()
-    self.muon_sf = lambda self, pt, eta: self.evaluator['sf_trig'](pt,eta) * self.evaluator['sf_id'](pt,eta) * self.evaluator['sf_iso'](pt,eta)
+    self.muon_sf_edges, table = build_binned_sf_table(full_fname, muon_sf_hists)
+    columns = {
+        "muon_weight": table.trig * table.id * table.iso,
+        "muon_weight_up": ((table.trig + table.trig_error) * (table.id + table.id_error) *
+                           (table.iso + table.iso_error)),
+        "muon_weight_down": ((table.trig - table.trig_error) * (table.id - table.id_error) *
+                             (table.iso - table.iso_error)),
+    }
+    for source in muon_sf_hists:
+        columns[f"muon_weight_{source}"] = table[source]
+        columns[f"muon_weight_{source}_error"] = table[f"{source}_error"]
+    self.muon_sf_values = np.stack([columns[column] for column in self.muon_sf_columns])
+
+# tau flavour classes with dedicated ID scale factors, mapped to the genPartFlav values
+# 1: prompt e, 2: prompt mu, 3: tau->e, 4: tau->mu, 5: tau_had, others get a scale factor of one
+tau_sf_classes = {
+    "tau_had"   : (5,),
+    "e_fake"    : (1, 3),
+    "mu_fake"   : (2, 4),
+}
+tau_id_sf_systs = ("nom", "up", "down")
 
 @producer(
     uses={f"Tau.{var}" for var in [
@@ -129,11 +320,11 @@ def muon_weight_setup(
                 ] 
     },
     produces={
-        "tau_id_sf"
+        "tau_id_sf", "tau_id_sf_up", "tau_id_sf_down"
     },
     mc_only=True,
 )
-def tau_weight(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+def tau_weight(self: Producer, events: ak.Array, stage: ColumnStage | None = None, **kwargs) -> ak.Array:
     """
     Producer for tau scale factors derived by the TAU POG. Requires an external file in the
     config under ``tau_correction``:
@@ -154,51 +345,58 @@ def tau_weight(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
     abseta = flat_np_view(abs(events.Tau.eta), axis=1)
     dm = flat_np_view(events.Tau.decayMode, axis=1)
     match = flat_np_view(events.Tau.genPartFlav, axis=1)
+    pair_only = self.config_inst.x("lepton_weights_pair_only", False)
+    if pair_only:
+        #Only the pair tau, i.e. the first tau after the reduction
+        has_tau, idx = first_flat_index(events.Tau.pt)
+        pt, abseta, dm, match = pt[idx], abseta[idx], dm[idx], match[idx]
     
-    syst = "nom" # TODO define this systematics inside config file
     deep_tau = self.config_inst.x.deep_tau
-    #Get working points of the DeepTau tagger
-    #Create scale factor for tau vs jet classifier 
-    sf_nom = np.ones_like(pt, dtype=np.float32)
-    mask = np.ones_like(pt, dtype=np.float32) #TODO Propagate here the mask for each channel i.e. etau, mutau, tautau 
-   
-    tau_part_flav = {
-        "prompt_e"  : 1,
-        "prompt_mu" : 2,
-        "tau->e"    : 3,
-        "tau->mu"   : 4,
-        "tau_had"   : 5
-    }
-    #Calculate tau ID scale factors for genuine taus
-    # pt, dm, genmatch, jet wp, e wp, syst, sf type
-       
-    tau_mask = flat_np_view(events.Tau.genPartFlav == tau_part_flav["tau_had"])
-    sf_nom[tau_mask] = self.id_vs_jet_corrector.evaluate(pt[tau_mask],
-                                                         dm[tau_mask],
-                                                         match[tau_mask],
-                                                         deep_tau.vs_jet,
-                                                         deep_tau.vs_e, 
-                                                         syst,
-                                                         "dm")
+    #TODO Propagate here the mask for each channel i.e. etau, mutau, tautau 
     
-    #Calculate tau ID scale factors for electron fakes
+    #Sort taus once by their flavour class, so that every corrector is evaluated on contiguous
+    #slices of the sorted inputs and all results are written back in a single scatter
+    tau_class = self.tau_flav_class[match]
+    order = np.argsort(tau_class, kind="stable")
+    bounds = offsets_from_counts(np.bincount(tau_class, minlength=len(tau_sf_classes) + 1))
+    pt_s, abseta_s, dm_s, match_s = pt[order], abseta[order], dm[order], match[order]
     
-    e_mask = ((match == tau_part_flav["prompt_e"]) | (match == tau_part_flav["tau->e"]))
-    
-    sf_nom[e_mask] = self.id_vs_e_corrector.evaluate(abseta[e_mask],
-                                                     dm[e_mask],
-                                                     match[e_mask],
-                                                     deep_tau.vs_e, 
-                                                     syst)
-    
-    #Calculate tau ID scale factors for muon fakes
-    mu_mask = ((match == tau_part_flav["prompt_mu"]) | (match == tau_part_flav["tau->mu"]))
-    sf_nom[mu_mask] = self.id_vs_mu_corrector.evaluate(abseta[mu_mask],
-                                                      match[mu_mask],
-                                                      deep_tau.vs_mu, 
-                                                      syst)
-
-    events = set_ak_column(events, "tau_id_sf", sf_nom, value_type=np.float32)
+    #Nominal, up and down scale factors, one for taus of other flavours
+    sf_sorted = np.ones((len(tau_id_sf_systs), len(pt)), dtype=np.float32)
+    for i, syst in enumerate(tau_id_sf_systs):
+        # genuine taus: pt, dm, genmatch, jet wp, e wp, syst, sf type
+        cls = slice(bounds[1], bounds[2])
+        sf_sorted[i, cls] = self.id_vs_jet_corrector.evaluate(pt_s[cls],
+                                                              dm_s[cls],
+                                                              match_s[cls],
+                                                              deep_tau.vs_jet,
+                                                              deep_tau.vs_e,
+                                                              syst,
+                                                              "dm")
+        # electron fakes: abseta, dm, genmatch, e wp, syst
+        cls = slice(bounds[2], bounds[3])
+        sf_sorted[i, cls] = self.id_vs_e_corrector.evaluate(abseta_s[cls],
+                                                            dm_s[cls],
+                                                            match_s[cls],
+                                                            deep_tau.vs_e,
+                                                            syst)
+        # muon fakes: abseta, genmatch, mu wp, syst
+        cls = slice(bounds[3], bounds[4])
+        sf_sorted[i, cls] = self.id_vs_mu_corrector.evaluate(abseta_s[cls],
+                                                             match_s[cls],
+                                                             deep_tau.vs_mu,
+                                                             syst)
+    sf = np.empty_like(sf_sorted)
+    sf[:, order] = sf_sorted
+
+    if pair_only:
+        #Flat weights per event, events without tau are not weighted
+        sf_pair = np.ones((len(tau_id_sf_systs), len(events)), dtype=np.float32)
+        sf_pair[:, has_tau] = sf
+        sf = sf_pair
+    for syst, sf_syst in zip(tau_id_sf_systs, sf):
+        column = "tau_id_sf" if syst == "nom" else f"tau_id_sf_{syst}"
+        events = stage_column(events, column, sf_syst, stage, value_type=np.float32)
     
     
     return events
@@ -219,16 +417,76 @@ def tau_weight_setup(
     reader_targets: InsertableDict,
 ) -> None:
     bundle = reqs["external_files"]
-    import correctionlib
-    correctionlib.highlevel.Correction.__call__ = correctionlib.highlevel.Correction.evaluate
-    
-    correction_set = correctionlib.CorrectionSet.from_string(
-        bundle.files.tau_correction.load(formatter="gzip").decode("utf-8"),
-    )
+    #The correction set is parsed once per process and shared with other calibrators and producers
+    correction_set = load_correction_set(bundle.files.tau_correction)
     tagger_name = self.config_inst.x.deep_tau.tagger
     self.id_vs_jet_corrector    = correction_set[f"{tagger_name}VSjet"]
     self.id_vs_e_corrector      = correction_set[f"{tagger_name}VSe"]
     self.id_vs_mu_corrector     = correction_set[f"{tagger_name}VSmu"]
     self.tes_corrector          = correction_set["tau_energy_scale"]
+    #Class number (1, 2, 3 in the order of tau_sf_classes, 0 for no scale factor) per genPartFlav
+    self.tau_flav_class = np.zeros(256, dtype=np.int64)
+    for i, flavs in enumerate(tau_sf_classes.values(), 1):
+        self.tau_flav_class[list(flavs)] = i
+
+
+
+@producer(
+    mc_only=True,
+)
+def total_weight(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    Multiplies all weight columns in cfg.x.event_weights once and stores the product as
+    total_weight, as well as total_weight_<shift> for each shift in which the column of one of the
+    weights is replaced by its alias. The nominal weights per source are stored in the matrix
+    event_weight_matrix with one entry per event and source, in the order of cfg.x.event_weights.
+    The storage types are taken from cfg.x.event_weight_dtypes, float32 per default, float64 or
+    float16 with reduced precision.
+    Jagged weights, i.e. per object, are multiplied per event first.
+    """
+    def read(column):
+        weight = Route(column).apply(events)
+        if weight.ndim > 1:
+            weight = ak.prod(weight, axis=1)
+        return np.asarray(weight, dtype=np.float64)
+
+    weights = np.stack([read(column) for column in self.weight_columns])
+    events = set_ak_column(events, "total_weight", np.prod(weights, axis=0),
+                           value_type=self.weight_dtypes["total"])
+    for shift_name, (i, column) in self.weight_shifts.items():
+        shifted = weights.copy()
+        shifted[i] = read(column)
+        events = set_ak_column(events, f"total_weight_{shift_name}", np.prod(shifted, axis=0),
+                               value_type=self.weight_dtypes["total"])
 
+    #One row of source weights per event
+    events = set_ak_column(events, "event_weight_matrix", ak.Array(np.ascontiguousarray(weights.T)),
+                           value_type=self.weight_dtypes["sources"])
+    return events
 
+@total_weight.init
+def total_weight_init(self: Producer) -> None:
+    #Index and column of the varied weight per shift, taken from the column aliases of the shifts
+    self.weight_columns = list(self.config_inst.x.event_weights.keys())
+    self.weight_shifts = {}
+    for i, (column, shift_insts) in enumerate(self.config_inst.x.event_weights.items()):
+        for shift_inst in shift_insts:
+            varied_column = shift_inst.x("column_aliases", {}).get(column, column)
+            self.weight_shifts[shift_inst.name] = (i, varied_column)
+    self.uses |= set(self.weight_columns) | {column for _, column in self.weight_shifts.values()}
+    #Storage types of the total weights and the source matrix
+    self.weight_dtypes = {"total": "float32", "sources": "float32"}
+    self.weight_dtypes.update(self.config_inst.x("event_weight_dtypes", {}))
+    for key, dtype in self.weight_dtypes.items():
+        if dtype not in ("float16", "float32", "float64"):
+            raise ValueError(
+                f"invalid event_weight_dtypes.{key} '{dtype}', expected 'float16', 'float32' or 'float64'",
+            )
+        if dtype == "float16":
+            logger.warning(
+                f"event_weight_dtypes.{key} is float16, weights are stored with about three significant "
+                "digits and overflow above 65504",
+            )
+    self.produces |= {"total_weight", "event_weight_matrix"} | {
+        f"total_weight_{shift_name}" for shift_name in self.weight_shifts
+    }
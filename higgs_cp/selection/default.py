@@ -1,6 +1,8 @@
 from operator import and_
 from functools import reduce
 
+import law
+
 from columnflow.production.util import attach_coffea_behavior
 from columnflow.production.categories import category_ids
 from columnflow.production.processes import process_ids
@@ -15,8 +17,10 @@ from higgs_cp.selection.trigger import trigger_selection
 from higgs_cp.selection.lepton  import study_muon_selection, study_tau_selection, mutau_selection, extra_lepton_veto, dilepton_veto
 from higgs_cp.selection.trigger  import trigger_matching
 from higgs_cp.selection.jet_veto import jet_veto
+from higgs_cp.selection.util import SelectionContext, StepProfiler, take_events, scatter_events, sum_per_process
 from higgs_cp.production.mutau_vars import mT 
 from higgs_cp.production.weights import pu_weight,get_mc_weight
+from higgs_cp.calibration.tau import tes_shifts
 
 from columnflow.util import maybe_import, dev_sandbox
 from higgs_cp.production.example import cutflow_features
@@ -26,6 +30,8 @@ np = maybe_import("numpy")
 ak = maybe_import("awkward")
 coffea = maybe_import("coffea")
 
+logger = law.logger.get_logger(__name__)
+
 @selector(uses={"process_id", optional("mc_weight")})
 def custom_increment_stats(
     self: Selector,
@@ -39,10 +45,11 @@ def custom_increment_stats(
     *stats* in-place based on all input *events* and the final selection *mask*.
     """
     # get event masks
-    event_mask = results.event
+    event_mask = np.asarray(results.event)
 
     # get a list of unique process ids present in the chunk
-    unique_process_ids = np.unique(events.process_id)
+    process_id = np.asarray(events.process_id)
+    unique_process_ids = np.unique(process_id)
     
     # increment plain counts
     n_evt_per_file = self.dataset_inst.n_events/self.dataset_inst.n_files
@@ -62,16 +69,15 @@ def custom_increment_stats(
 
     # get and store the sum of weights in the stats dictionary
     for name, (weights, mask) in weight_map.items():
-        joinable_mask = True if mask is Ellipsis else mask
+        joinable_mask = None if mask is Ellipsis else mask
 
+        # sums per process id, obtained in a single pass over a dense process index
+        process_ids_, sums = sum_per_process(process_id, weights, joinable_mask)
         # sum of different weights in weight_map for all processes
-        stats[f"sum_{name}"] += ak.sum(weights[mask])
-        # sums per process id
+        stats[f"sum_{name}"] += float(sums.sum())
         stats.setdefault(f"sum_{name}_per_process", defaultdict(float))
-        for p in unique_process_ids:
-            stats[f"sum_{name}_per_process"][int(p)] += ak.sum(
-                weights[(events.process_id == p) & joinable_mask],
-            )
+        for p, w in zip(process_ids_, sums):
+            stats[f"sum_{name}_per_process"][int(p)] += float(w)
 
     return events, results
 
@@ -113,6 +119,8 @@ def custom_increment_stats(
         custom_increment_stats,
         mT,
     },
+    # the selection and the reduction of the tes shifts run on the varied tau pt and mass
+    shifts=tes_shifts,
     sandbox=dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar_dev.sh"),
     exposed=True,
 )
@@ -123,78 +131,122 @@ def default(
     **kwargs,
 ) -> tuple[ak.Array, SelectionResult]:
     
+    results = SelectionResult()
+    #Per step timing, memory and event counts, written to the stats when enabled
+    profiler = StepProfiler(results, enabled=self.config_inst.x("selection_profiling", False))
+
     # ensure coffea behaviors are loaded
-    events = self[attach_coffea_behavior](events, **kwargs)
-    events = self[mT](events, **kwargs)
+    with profiler("attach_coffea_behavior", events):
+        events = self[attach_coffea_behavior](events, **kwargs)
+    with profiler("mT", events):
+        events = self[mT](events, **kwargs)
     
     if self.dataset_inst.is_mc:
         # add corrected mc weights
-        events = self[get_mc_weight](events, **kwargs)
+        with profiler("get_mc_weight", events):
+            events = self[get_mc_weight](events, **kwargs)
         
-    results = SelectionResult()
     # filter bad data events according to golden lumi mask
     if self.dataset_inst.is_data:
-        events, json_filter_results = self[json_filter](events, **kwargs)
-        results += json_filter_results
-    events, trigger_results = self[trigger_selection](events, call_force=True, **kwargs)
-    results += trigger_results
+        with profiler("json_filter", events):
+            events, json_filter_results = self[json_filter](events, **kwargs)
+            results += json_filter_results
+    with profiler("trigger_selection", events):
+        events, trigger_results = self[trigger_selection](events, call_force=True, **kwargs)
+        results += trigger_results
     
-    events, jet_veto_results = self[jet_veto](events, call_force=True, **kwargs)
-    results += jet_veto_results
+    with profiler("jet_veto", events):
+        events, jet_veto_results = self[jet_veto](events, call_force=True, **kwargs)
+        results += jet_veto_results
     
-    events, muon_results, muon_mask = self[study_muon_selection](events,
-                                                                 call_force=True,
-                                                                 **kwargs)
-    results += muon_results
-    events, tau_results, tau_mask = self[study_tau_selection](events,
-                                                              call_force=True,
-                                                              **kwargs)
-    results += tau_results
+    with profiler("study_muon_selection", events):
+        events, muon_results, muon_mask = self[study_muon_selection](events,
+                                                                     call_force=True,
+                                                                     **kwargs)
+        results += muon_results
+    with profiler("study_tau_selection", events):
+        events, tau_results, tau_mask = self[study_tau_selection](events,
+                                                                  call_force=True,
+                                                                  **kwargs)
+        results += tau_results
     
-    events, mutau_results, pair_mu_idx, pair_tau_idx = self[mutau_selection](events,
-                                                  muon_mask,
-                                                  tau_mask,
-                                                  call_force=True,
-                                                  **kwargs)
-    results += mutau_results
-
-    events, dilepton_veto_results = self[dilepton_veto](events,
-                                                            pair_mu_idx,
-                                                            pair_tau_idx,
-                                                            call_force=True,
-                                                            **kwargs)
-    results += dilepton_veto_results
+    #In progressive mode the pair selection below only runs on events that passed all steps so far,
+    #the results are scattered back to all events so that the final selection and the cumulative
+    #cutflow stay the same, skipped events pass the pair steps as they are already rejected
+    if self.config_inst.x("selection_progressive", False):
+        presel = reduce(and_, results.steps.values())
+        pair_events = events[presel]
+        muon_mask, tau_mask = muon_mask[presel], tau_mask[presel]
+        pair_trigger_results = take_events(trigger_results, presel)
+        #The pair steps are profiled on the pair events and their own results
+        pair_results = SelectionResult()
+        pair_profiler = profiler.derive(pair_results)
+
+        def scatter(sub_results):
+            pair_results.steps.update(sub_results.steps)
+            return scatter_events(sub_results, presel, fill_steps=True)
+    else:
+        pair_events = events
+        pair_trigger_results = trigger_results
+        pair_profiler = profiler
+        scatter = lambda sub_results: sub_results
+
+    with pair_profiler("mutau_selection", pair_events):
+        pair_events, mutau_results, pair_mu_idx, pair_tau_idx = self[mutau_selection](pair_events,
+                                                      muon_mask,
+                                                      tau_mask,
+                                                      call_force=True,
+                                                      **kwargs)
+        results += scatter(mutau_results)
     
-    events, extralep_veto_results, pair_mu_idx, pair_tau_idx = self[extra_lepton_veto](events,
-                                                            pair_mu_idx,
-                                                            pair_tau_idx,
-                                                            call_force=True,
-                                                            **kwargs)
-    results += extralep_veto_results
+    #Pair masks and Lorentz vectors are computed once and shared by the selectors below
+    context = SelectionContext(pair_events, pair_mu_idx, pair_tau_idx)
+
+    with pair_profiler("dilepton_veto", pair_events):
+        pair_events, dilepton_veto_results = self[dilepton_veto](pair_events,
+                                                                pair_mu_idx,
+                                                                pair_tau_idx,
+                                                                call_force=True,
+                                                                **kwargs)
+        results += scatter(dilepton_veto_results)
+    
+    with pair_profiler("extra_lepton_veto", pair_events):
+        pair_events, extralep_veto_results, pair_mu_idx, pair_tau_idx = self[extra_lepton_veto](pair_events,
+                                                                pair_mu_idx,
+                                                                pair_tau_idx,
+                                                                context=context,
+                                                                call_force=True,
+                                                                **kwargs)
+        results += scatter(extralep_veto_results)
     
     print(f"Sum evt: before trig mathcing: {ak.sum(ak.num(pair_mu_idx,axis=1))}")
-    events, trigger_mathcing_results = self[trigger_matching](events,
-                                                            pair_mu_idx,
-                                                            pair_tau_idx,
-                                                            trigger_results,
-                                                            call_force=True,
-                                                            **kwargs)
-   
-    results += trigger_mathcing_results
+    with pair_profiler("trigger_matching", pair_events):
+        pair_events, trigger_mathcing_results = self[trigger_matching](pair_events,
+                                                                pair_mu_idx,
+                                                                pair_tau_idx,
+                                                                pair_trigger_results,
+                                                                context=context,
+                                                                call_force=True,
+                                                                **kwargs)
+        results += scatter(trigger_mathcing_results)
+    logger.debug(f"selection context built {context.n_built} and saved {context.n_saved} jagged arrays")
     print(f"Sum evt: after trig mathcing: {ak.sum(trigger_mathcing_results.steps['trigger_matching'])}")
     #Produce pair relative charge for categoriation and QCD estimation
     
     # write out process IDs
-    events = self[process_ids](events, **kwargs)
+    with profiler("process_ids", events):
+        events = self[process_ids](events, **kwargs)
     #events = self[category_ids](events, results=results, **kwargs)
    
    
     event_sel = reduce(and_, results.steps.values())
     results.event = event_sel
    
-    events, results = self[custom_increment_stats]( 
-                                                   events,
-                                                   results,
-                                                   stats,
-    )
+    with profiler("custom_increment_stats", events):
+        events, results = self[custom_increment_stats]( 
+                                                       events,
+                                                       results,
+                                                       stats,
+        )
+    profiler.fill(stats)
     return events, results
@@ -7,9 +7,11 @@ Lepton selection methods.
 from __future__ import annotations
 
 from columnflow.selection import Selector, SelectionResult, selector
-from columnflow.columnar_util import set_ak_column
+from columnflow.columnar_util import set_ak_column, flat_np_view
 from columnflow.util import DotDict, maybe_import
 from columnflow.production.util import attach_coffea_behavior
+from higgs_cp.util import jit, offsets_from_counts, segment_sum
+from higgs_cp.selection.util import SelectionContext
 
 
 
@@ -97,71 +99,174 @@ def study_tau_selection(
     
     
 def select_from_multiple_pairs(events: ak.Array,
-                        preselection: ak.Array,
-                        muons: ak.Array,
-                        taus: ak.Array,
-                        muon_idx: ak.Array,
-                        tau_idx: ak.Array,)-> tuple[selected_events  : ak.Array,
-                                                    selected_muon_idx: ak.Array,
-                                                     selected_tau_idx: ak.Array]:
-                            
-    empty_indices = ak.zeros_like(1 * events.event, dtype=np.int32)[:, np.newaxis][..., :0]
-    selected_muon_idx = empty_indices
-    selected_tau_idx  = empty_indices
-    selected_events   = ak.zeros_like(1 * events.event, dtype=np.bool_)
-    
-    n_multipair_events = ak.sum(ak.sum(preselection, axis=1) > 1)
-    if n_multipair_events > 0: 
-        #print("Check the multiple pair selection:")                
-        muons = ak.drop_none(ak.mask(muons, preselection), behavior=coffea.nanoevents.methods.vector.behavior)
-        muons = ak.with_name(muons, "PtEtaPhiMLorentzVector") #Keep Lorentz vector arithmetics
-        muon_idx = ak.drop_none(ak.mask(muon_idx, preselection))
-        taus = ak.drop_none(ak.mask(taus, preselection), behavior=coffea.nanoevents.methods.vector.behavior)
-        taus = ak.with_name(taus, "PtEtaPhiMLorentzVector") #Keep Lorentz vector arithmetics
-        tau_idx = ak.drop_none(ak.mask(tau_idx, preselection))
-        
-        vars4selection = ['muon_pfRelIso04_all', 'muon_pt', 'tau_rawDeepTau2018v2p5VSjet', 'tau_pt']
-        is_equal = ak.ones_like(1 * events.event, dtype=np.bool_) #Init is_equal to all Trues allows proper selection during the first loop iteration
-        
-        for var in vars4selection:
-            leptons = muons if "muon" in var else taus
-            varname = var.split('_',1)[1]
-            do_ascending = (var == 'muon_pfRelIso04_all')# Muons with low iso are the best!
-            pair_idx_sorted = ak.argsort(leptons[varname],
-                                        axis=1,
-                                        ascending=do_ascending) 
-
-            sorted_array = ak.pad_none(leptons[pair_idx_sorted],2, axis=1)
-            leading_particle      = sorted_array[:,0]
-            subleading_particle   = sorted_array[:,1]
-        
-            first_muon = muon_idx[pair_idx_sorted][:,:1]
-            first_tau  = tau_idx[pair_idx_sorted][:,:1]
-            #print(f"{varname}: lead = {leading_particle[ak.num(muons,axis=1)>1][varname][0]}, sublead = {subleading_particle[ak.num(muons,axis=1)>1][varname][0]}")
-            if do_ascending:
-                selection = ak.fill_none(leading_particle[varname] < subleading_particle[varname],False) #Lower isolation for muon
-            else:
-                selection = ak.fill_none(leading_particle[varname] > subleading_particle[varname],False) #mu/tau pt and DeepTau score
-                
-            selection = selection & is_equal # Choose only events that had equal values of the seleciton variable
-           
-            #print(f"selection: {ak.any(selection)}, is equal: {ak.any(is_equal)}")
-            buf_muon_idx = empty_indices
-            buf_tau_idx  = empty_indices
-            buf_muon_idx = ak.where(selection,first_muon,buf_muon_idx)
-            buf_tau_idx  = ak.where(selection,first_tau, buf_tau_idx)
-            
-            selected_muon_idx = ak.concatenate([buf_muon_idx,
-                                                selected_muon_idx],
-                                            axis=1)
-            selected_tau_idx  = ak.concatenate([buf_tau_idx,
-                                                selected_tau_idx],
-                                            axis=1)
-            selected_events = (selected_events | selection)
-            is_equal = (ak.fill_none(leading_particle[varname] == subleading_particle[varname], False) & ~ak.is_none(leading_particle[varname]))
-        
+                               pairs: DotDict,) -> tuple[np.ndarray, ak.Array, ak.Array]:
+    """
+    Chooses the best preselected mu-tau pair per event, given *pairs* built by
+    :py:func:`build_mutau_pairs`. Pairs are ranked lexicographically by the muon isolation
+    (ascending), the muon pt, the raw DeepTau vs jet score and the tau pt (all descending). The
+    ranking is done with a single sort of all preselected pairs of the chunk, keyed by event first,
+    so that the best pair is the first entry of each event segment. Pairs that are equal in all
+    four criteria are resolved by their original order.
+    
+    Returns the mask of events with at least one preselected pair and the jagged muon and tau
+    indices of the chosen pair.
+    """
+    n_events = len(pairs.n)
+    pair_evt = np.repeat(np.arange(n_events), pairs.n)
+    mu_offsets = offsets_from_counts(np.asarray(ak.num(events.Muon.pt, axis=1)))
+    tau_offsets = offsets_from_counts(np.asarray(ak.num(events.Tau.pt, axis=1)))
+    
+    #Only preselected pairs take part in the arbitration
+    cand = np.flatnonzero(pairs.presel)
+    cand_evt = pair_evt[cand]
+    mu_glob = mu_offsets[cand_evt] + pairs.mu_idx[cand]
+    tau_glob = tau_offsets[cand_evt] + pairs.tau_idx[cand]
+    
+    #np.lexsort uses the last key as the primary one
+    order = np.lexsort((
+        -flat_np_view(events.Tau.pt, axis=1)[tau_glob],
+        -flat_np_view(events.Tau.rawDeepTau2018v2p5VSjet, axis=1)[tau_glob],
+        -flat_np_view(events.Muon.pt, axis=1)[mu_glob],
+        flat_np_view(events.Muon.pfRelIso04_all, axis=1)[mu_glob], # Muons with low iso are the best!
+        cand_evt,
+    ))
+    sorted_evt = cand_evt[order]
+    is_first = np.ones(len(order), dtype=np.bool_)
+    is_first[1:] = sorted_evt[1:] != sorted_evt[:-1]
+    best = cand[order[is_first]]
+    
+    selected_events = np.zeros(n_events, dtype=np.bool_)
+    selected_events[pair_evt[best]] = True
+    counts = selected_events.astype(np.int64)
+    selected_muon_idx = ak.unflatten(pairs.mu_idx[best], counts)
+    selected_tau_idx = ak.unflatten(pairs.tau_idx[best], counts)
     return selected_events, selected_muon_idx, selected_tau_idx
     
+
+def _fill_mutau_pairs(mu_offsets, mu_mask, mu_eta, mu_phi, mu_mt,
+                      tau_offsets, tau_mask, tau_eta, tau_phi,
+                      pair_offsets, pair_mu_idx, pair_tau_idx, pair_dr, pair_mt, pair_pass):
+    # numba kernel, compiled on first use via higgs_cp.util.jit
+    for evt in range(len(mu_offsets) - 1):
+        k = pair_offsets[evt]
+        for i in range(mu_offsets[evt], mu_offsets[evt + 1]):
+            if not mu_mask[i]:
+                continue
+            for j in range(tau_offsets[evt], tau_offsets[evt + 1]):
+                if not tau_mask[j]:
+                    continue
+                # same arithmetic as coffea's delta_r of Lorentz vectors, a numba ufunc that also
+                # computes delta_phi with the float64 np.pi, which gives bit-identical values as
+                # checked by scripts/check_mutau_pairs.py, float32 constants would not
+                deta = mu_eta[i] - tau_eta[j]
+                dphi = np.float32((mu_phi[i] - tau_phi[j] + np.pi) % (2 * np.pi) - np.pi)
+                pair_mu_idx[k] = i - mu_offsets[evt]
+                pair_tau_idx[k] = j - tau_offsets[evt]
+                pair_dr[k] = np.hypot(deta, dphi)
+                pair_mt[k] = mu_mt[i]
+                pair_pass[k] = (pair_dr[k] > 0.5) & (pair_mt[k] < 50)
+                k += 1
+
+
+def build_mutau_pairs(events: ak.Array,
+                      muon_mask: ak.Array,
+                      tau_mask: ak.Array,) -> DotDict:
+    """
+    Builds all pairs of preselected muons and taus directly on the flat ``Muon`` and ``Tau``
+    buffers in a single compiled pass, without materializing the cartesian product. Returns a
+    DotDict with the number of pairs per event ``n`` and their ``offsets``, as well as flat arrays
+    ``mu_idx`` and ``tau_idx`` (local object indices), ``dr``, ``mt`` (muon transverse mass) and
+    ``presel`` (dR > 0.5 and mT < 50) per pair.
+    """
+    mu_offsets = offsets_from_counts(np.asarray(ak.num(events.Muon.pt, axis=1)))
+    tau_offsets = offsets_from_counts(np.asarray(ak.num(events.Tau.pt, axis=1)))
+    mu_mask = flat_np_view(muon_mask, axis=1)
+    tau_mask = flat_np_view(tau_mask, axis=1)
+
+    n_pairs = segment_sum(mu_mask, mu_offsets) * segment_sum(tau_mask, tau_offsets)
+    pair_offsets = offsets_from_counts(n_pairs)
+    n_total = pair_offsets[-1]
+    pairs = DotDict(
+        n=n_pairs,
+        offsets=pair_offsets,
+        mu_idx=np.empty(n_total, dtype=np.int32),
+        tau_idx=np.empty(n_total, dtype=np.int32),
+        dr=np.empty(n_total, dtype=np.float32),
+        mt=np.empty(n_total, dtype=np.float32),
+        presel=np.empty(n_total, dtype=np.bool_),
+    )
+    jit(_fill_mutau_pairs)(
+        mu_offsets, mu_mask,
+        flat_np_view(events.Muon.eta, axis=1),
+        flat_np_view(events.Muon.phi, axis=1),
+        flat_np_view(events.Muon.mT, axis=1),
+        tau_offsets, tau_mask,
+        flat_np_view(events.Tau.eta, axis=1),
+        flat_np_view(events.Tau.phi, axis=1),
+        pair_offsets, pairs.mu_idx, pairs.tau_idx, pairs.dr, pairs.mt, pairs.presel,
+    )
+    return pairs
+
+
+def build_mutau_pairs_awkward(events: ak.Array,
+                              muon_mask: ak.Array,
+                              tau_mask: ak.Array,) -> DotDict:
+    """
+    Builds all pairs of preselected muons and taus with the cartesian product of the preselected
+    Lorentz vectors, and returns them in the layout of :py:func:`build_mutau_pairs`.
+    """
+    muon_indices = ak.local_index(events.Muon, axis=1)
+    preselected_muons = ak.drop_none(ak.mask(events.Muon, muon_mask),
+                                     behavior=coffea.nanoevents.methods.vector.behavior)
+    preselected_muons = ak.with_name(preselected_muons, "PtEtaPhiMLorentzVector") #Keep Lorentz vector arithmetics
+    preselected_muon_indices = ak.drop_none(ak.mask(muon_indices, muon_mask))
+
+    tau_indices = ak.local_index(events.Tau, axis=1)
+    preselected_taus = ak.drop_none(ak.mask(events.Tau, tau_mask),
+                                    behavior=coffea.nanoevents.methods.vector.behavior)
+    preselected_taus = ak.with_name(preselected_taus, "PtEtaPhiMLorentzVector")
+    preselected_tau_indices = ak.drop_none(ak.mask(tau_indices, tau_mask)) 
+
+    #Produce pairs the preselected muons and taus
+    pair_mu, pair_tau = ak.unzip(ak.cartesian([preselected_muons,
+                                               preselected_taus], axis=1))
+
+    pair_mu_raw_idx, pair_tau_raw_idx = ak.unzip(ak.cartesian([preselected_muon_indices,
+                                                     preselected_tau_indices], axis=1))
+    #is_os               = (pair_mu.charge * pair_tau.charge) < 0 #Opposite sign mask, I created a custom producer to save this variable and create categories for QCD estimation
+    pair_dr = pair_mu.delta_r(pair_tau)
+    deltaR_selection    = pair_dr > 0.5 #dR between pair constituents
+    mT_selection        = pair_mu.mT < 50 # effective mass of muon and MET < 50 GeV/c2
+
+    pair_preselection = deltaR_selection & mT_selection #Removed is_os variable to create QCD categories
+
+    #Flatten the pairs to the same layout as produced by the numba engine
+    n_pairs = np.asarray(ak.num(pair_preselection, axis=1))
+    pairs = DotDict(
+        n=n_pairs,
+        offsets=offsets_from_counts(n_pairs),
+        mu_idx=np.asarray(ak.flatten(pair_mu_raw_idx, axis=1), dtype=np.int32),
+        tau_idx=np.asarray(ak.flatten(pair_tau_raw_idx, axis=1), dtype=np.int32),
+        dr=np.asarray(ak.flatten(pair_dr, axis=1), dtype=np.float32),
+        mt=np.asarray(ak.flatten(pair_mu.mT, axis=1), dtype=np.float32),
+        presel=np.asarray(ak.flatten(pair_preselection, axis=1), dtype=np.bool_),
+    )
+    return pairs
+
+
+def select_single_pair(pairs: DotDict) -> tuple[np.ndarray, ak.Array, ak.Array]:
+    """
+    Selects events with exactly one mu-tau pair that also passes the pair preselection, given
+    *pairs* built by :py:func:`build_mutau_pairs`. Returns the event mask and the jagged muon and
+    tau indices of the selected pair.
+    """
+    single_pair = (pairs.n == 1) & (segment_sum(pairs.presel, pairs.offsets) == 1)
+    first_pair = pairs.offsets[:-1][single_pair]
+    counts = single_pair.astype(np.int64)
+    single_muon_indices = ak.unflatten(pairs.mu_idx[first_pair], counts)
+    single_tau_indices = ak.unflatten(pairs.tau_idx[first_pair], counts)
+    return single_pair, single_muon_indices, single_tau_indices
+
                     
 @selector(
     uses = 
@@ -187,75 +292,33 @@ def mutau_selection(
     tau_mask : ak.Array,
     **kwargs,
 ) -> tuple[ak.Array, ak.Array, ak.Array, ak.Array]:  
-          
-    muon_indices = ak.local_index(events.Muon, axis=1)
-    preselected_muons = ak.drop_none(ak.mask(events.Muon, muon_mask),
-                                     behavior=coffea.nanoevents.methods.vector.behavior)
-    preselected_muons = ak.with_name(preselected_muons, "PtEtaPhiMLorentzVector") #Keep Lorentz vector arithmetics
-    preselected_muon_indices = ak.drop_none(ak.mask(muon_indices, muon_mask))
     
-    tau_indices = ak.local_index(events.Tau, axis=1)
-    preselected_taus = ak.drop_none(ak.mask(events.Tau, tau_mask),
-                                    behavior=coffea.nanoevents.methods.vector.behavior)
-    preselected_taus = ak.with_name(preselected_taus, "PtEtaPhiMLorentzVector")
-    preselected_tau_indices = ak.drop_none(ak.mask(tau_indices, tau_mask)) 
-    empty_events = ak.zeros_like(1 * events.event, dtype=np.uint16)
-    empty_indices = empty_events[:, np.newaxis][..., :0]
+    #The pair building engine is chosen in the config, both engines give identical results
+    pair_builder = self.config_inst.x("mutau_pair_builder", "awkward")
+    if pair_builder not in ("awkward", "numba"):
+        raise ValueError(f"unknown mutau_pair_builder '{pair_builder}', expected 'awkward' or 'numba'")
+    pair_selection = self.config_inst.x("mutau_pair_selection", "single")
+    if pair_selection not in ("single", "best"):
+        raise ValueError(f"unknown mutau_pair_selection '{pair_selection}', expected 'single' or 'best'")
     
-    #Produce pairs the preselected muons and taus
-    pair_mu, pair_tau = ak.unzip(ak.cartesian([preselected_muons,
-                                               preselected_taus], axis=1))
+    if pair_builder == "numba":
+        pairs = build_mutau_pairs(events, muon_mask, tau_mask)
+    else:
+        pairs = build_mutau_pairs_awkward(events, muon_mask, tau_mask)
     
-    pair_mu_raw_idx, pair_tau_raw_idx = ak.unzip(ak.cartesian([preselected_muon_indices,
-                                                     preselected_tau_indices], axis=1))
-    #is_os               = (pair_mu.charge * pair_tau.charge) < 0 #Opposite sign mask, I created a custom producer to save this variable and create categories for QCD estimation
-    deltaR_selection    = pair_mu.delta_r(pair_tau) > 0.5 #dR between pair constituents
-    mT_selection        = pair_mu.mT < 50 # effective mass of muon and MET < 50 GeV/c2
     mutau_selections = {}
-    #mutau_selections['mutau_os']        = np.array(ak.sum(is_os,            axis=1) > 0, dtype=np.bool_) #any of mutau pairs of the event has opposite charge
-    #mutau_selections['mutau_dr_0p5']    = np.array(ak.sum(deltaR_selection, axis=1) > 0, dtype=np.bool_)
-    #mutau_selections['mutau_mt_50']     = np.array(ak.sum(mT_selection,     axis=1) > 0, dtype=np.bool_)
-    
-    pair_preselection = deltaR_selection & mT_selection #Removed is_os variable to create QCD categories
-    
-    #Selection of a events with a single pair passed the preselection
-    single_pair = (ak.num(pair_preselection, axis=1) == 1) & (ak.sum(pair_preselection, axis=1) == 1) #Check that event contains exactly one pair and this pair passed the preselection
-    
-    
-    
-    #Make object-level selections for muons and taus for single pair case
-    single_muon_indices = empty_indices
-    single_muon_indices = ak.where(single_pair,
-                                   pair_mu_raw_idx,
-                                   single_muon_indices) 
-    single_muon_indices = ak.values_astype(single_muon_indices, np.int32)
-    
-    single_tau_indices = empty_indices
-    single_tau_indices = ak.where(single_pair,
-                                  pair_tau_raw_idx,
-                                  single_tau_indices) 
-    single_tau_indices = ak.values_astype(single_tau_indices, np.int32)
-    mutau_selections['single_pair'] = np.array(single_pair , dtype=np.bool_)
-    # sel_multiple_pairs, sel_muon_idx, sel_tau_idx = select_from_multiple_pairs(events,
-    #                                                         pair_preselection,
-    #                                                         pair_mu,
-    #                                                         pair_tau,
-    #                                                         pair_mu_raw_idx,
-    #                                                         pair_tau_raw_idx)
-    
-    # print(f'selected indices: muons {sel_muon_idx[sel_multiple_pairs]}, taus - {sel_tau_idx[sel_multiple_pairs]}')
-    # print(f'N_pres_mu: {ak.num(preselected_muons[sel_multiple_pairs],axis=1)}, \
-    #     N_pres_tau: {ak.num(preselected_taus[sel_multiple_pairs],axis=1)}')
-    
-    # mutau_selections['sel_pairs'] = np.array(sel_multiple_pairs, dtype=np.bool_)
-    # if ak.any(sel_multiple_pairs):
-    #    pass
-    # sel_muon_idx = ak.drop_none(ak.firsts(sel_muon_idx, axis=1))
-    # sel_tau_idx = ak.drop_none(ak.firsts(sel_tau_idx, axis=1))
+    if pair_selection == "single":
+        #Selection of a events with a single pair passed the preselection
+        single_pair, pair_mu_idx, pair_tau_idx = select_single_pair(pairs)
+        mutau_selections['single_pair'] = single_pair
+    else:
+        #Choose the best pair in events with at least one preselected pair
+        best_pair, pair_mu_idx, pair_tau_idx = select_from_multiple_pairs(events, pairs)
+        mutau_selections['best_pair'] = best_pair
     
     return events, SelectionResult(
         steps=mutau_selections,
-    ), single_muon_indices, single_tau_indices,
+    ), pair_mu_idx, pair_tau_idx,
     
 @selector(
     uses={
@@ -271,37 +334,22 @@ def extra_lepton_veto(
     events: ak.Array,
     pair_mu_idx,
     pair_tau_idx,
+    context: SelectionContext | None = None,
     **kwargs,
 ) -> ak.Array :
     
     empty_indices = ak.zeros_like(1 * events.event, dtype=np.int32)[:, np.newaxis][..., :0]
-    #Prepare the mask for pair muons
-    raw_muon_idx = ak.local_index(events.Muon, axis=1)
-    
-    (buf_idx, _) = ak.broadcast_arrays(ak.firsts(pair_mu_idx,axis=1)[:,np.newaxis],raw_muon_idx)
-    pair_mu_mask = ak.fill_none(buf_idx == raw_muon_idx, False)
+    #Pair masks and Lorentz vectors of pair and extra muons are shared with other selectors
+    if context is None:
+        context = SelectionContext(events, pair_mu_idx, pair_tau_idx)
+    context.use("extra_lepton_veto")
     #Select extra muons i.e. those that are not in the pairs
-    extra_muons = ak.with_name(ak.drop_none(ak.mask(events.Muon, ~pair_mu_mask),
-                                            behavior=coffea.nanoevents.methods.vector.behavior),
-                               "PtEtaPhiMLorentzVector")
-    #Select pair muons
-    pair_muons =  ak.with_name(ak.drop_none(ak.mask(events.Muon, pair_mu_mask),
-                                            behavior=coffea.nanoevents.methods.vector.behavior),
-                               "PtEtaPhiMLorentzVector")
-                               
-    #Prepare the mask for pair taus
-    raw_tau_idx = ak.local_index(events.Tau, axis=1)
-    (buf_idx, _) = ak.broadcast_arrays(ak.firsts(pair_tau_idx,axis=1)[:,np.newaxis],raw_tau_idx)
-    pair_tau_mask = ak.fill_none(buf_idx == raw_tau_idx, False)
-    #Select pair taus
-    pair_taus = ak.with_name(ak.drop_none(ak.mask(events.Tau, pair_tau_mask), 
-                                          behavior=coffea.nanoevents.methods.vector.behavior),
-                             "PtEtaPhiMLorentzVector")
+    extra_muons = context.extra_muons
     #Calculate dR between all extra leptons and pair muons
-    (broadcasted_pair_mu, _) = ak.broadcast_arrays(ak.firsts(pair_muons,axis=1)[:,np.newaxis],extra_muons)
+    (broadcasted_pair_mu, _) = ak.broadcast_arrays(context.pair_muon[:,np.newaxis],extra_muons)
     mu_extralep_dr  = ak.fill_none(extra_muons.delta_r(broadcasted_pair_mu), -1)
     #Calculate dR between all exrea leptons and pair taus
-    (broadcasted_pair_tau, _) = ak.broadcast_arrays(ak.firsts(pair_taus,axis=1)[:,np.newaxis],extra_muons)
+    (broadcasted_pair_tau, _) = ak.broadcast_arrays(context.pair_tau[:,np.newaxis],extra_muons)
     tau_extralep_dr  = ak.fill_none(extra_muons.delta_r(broadcasted_pair_tau),-1)
 
     #Perform the selection of extra muons
@@ -360,9 +408,6 @@ def dilepton_veto(
     **kwargs,
 ) -> ak.Array:
     
-    empty_indices = ak.zeros_like(1 * events.event, dtype=np.int32)[:, np.newaxis][..., :0]
-    
-    raw_muon_idx = ak.local_index(events.Muon, axis=1)
     pair_mu1, pair_mu2 = ak.unzip(ak.combinations(events.Muon, 2, axis=1))
     dR_mu1_mu2 = pair_mu1.delta_r(pair_mu2)
     dimu_mask = ak.zeros_like(ak.local_index(pair_mu1, axis=1), dtype=np.bool_)
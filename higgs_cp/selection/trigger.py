@@ -2,8 +2,10 @@
 from __future__ import annotations
 
 from columnflow.selection import Selector, SelectionResult, selector
-from columnflow.util import maybe_import
-from columnflow.columnar_util import set_ak_column, optional_column as optional
+from columnflow.util import DotDict, maybe_import
+from columnflow.columnar_util import set_ak_column, flat_np_view, optional_column as optional
+from higgs_cp.util import jit, offsets_from_counts, segment_sum
+from higgs_cp.selection.util import SelectionContext
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
 coffea = maybe_import("coffea")
@@ -46,6 +48,83 @@ coffea = maybe_import("coffea")
 #     }
     
 
+def build_leg_table(triggers: list) -> DotDict:
+    """
+    Converts the legs of all *triggers* into flat lookup tables that are evaluated by the compiled
+    trigger leg matcher. Legs are numbered consecutively in the order of *triggers*, ``leg_start``
+    holds the number of the first leg of each trigger. Unset requirements are flagged in
+    ``has_pdg_id`` and ``has_min_pt``, the bit masks of each leg are padded to the maximum number
+    of masks and their actual number is stored in ``n_bits``.
+    """
+    legs = [leg for trigger in triggers for leg in trigger.legs]
+    n_masks = [len(leg.trigger_bits or []) for leg in legs]
+    trigger_bits = np.zeros((len(legs), max(n_masks, default=0)), dtype=np.int64)
+    for i, leg in enumerate(legs):
+        trigger_bits[i, :n_masks[i]] = leg.trigger_bits or []
+    return DotDict(
+        leg_start=offsets_from_counts(np.array([trigger.n_legs for trigger in triggers], dtype=np.int64)),
+        has_pdg_id=np.array([leg.pdg_id is not None for leg in legs], dtype=np.bool_),
+        pdg_id=np.array([leg.pdg_id or 0 for leg in legs], dtype=np.int64),
+        has_min_pt=np.array([leg.min_pt is not None for leg in legs], dtype=np.bool_),
+        # same precision as the comparison with the float32 TrigObj.pt column
+        min_pt=np.array([leg.min_pt or 0 for leg in legs], dtype=np.float32),
+        trigger_bits=trigger_bits,
+        n_bits=np.array(n_masks, dtype=np.int64),
+    )
+
+
+def _match_trigger_legs(offsets, obj_id, obj_pt, obj_bits,
+                        has_pdg_id, pdg_id, has_min_pt, min_pt, trigger_bits, n_bits,
+                        leg_mask, leg_any):
+    # numba kernel, compiled on first use via higgs_cp.util.jit
+    for evt in range(len(offsets) - 1):
+        for j in range(offsets[evt], offsets[evt + 1]):
+            abs_id = abs(obj_id[j])
+            for leg in range(len(pdg_id)):
+                passed = abs_id >= 0
+                if has_pdg_id[leg]:
+                    passed = passed and abs_id == pdg_id[leg]
+                if has_min_pt[leg]:
+                    passed = passed and obj_pt[j] >= min_pt[leg]
+                # AND between all bit masks, OR across the bits of each mask
+                for b in range(n_bits[leg]):
+                    passed = passed and (obj_bits[j] & trigger_bits[leg, b]) != 0
+                leg_mask[leg, j] = passed
+                if passed:
+                    leg_any[leg, evt] = True
+
+
+def match_trigger_legs(events: ak.Array, leg_table: DotDict) -> tuple[list, list, np.ndarray]:
+    """
+    Evaluates all legs in the *leg_table* built by :py:func:`build_leg_table` in a single compiled
+    pass over the flat ``TrigObj`` buffers. Returns per leg the jagged ``TrigObj`` mask and indices
+    of matching objects as well as an array of shape (legs, events) flagging events with at least
+    one matching object.
+    """
+    counts = np.asarray(ak.num(events.TrigObj.id, axis=1))
+    offsets = offsets_from_counts(counts)
+    n_legs = len(leg_table.pdg_id)
+    leg_mask = np.zeros((n_legs, offsets[-1]), dtype=np.bool_)
+    leg_any = np.zeros((n_legs, len(counts)), dtype=np.bool_)
+    jit(_match_trigger_legs)(
+        offsets,
+        flat_np_view(events.TrigObj.id, axis=1),
+        flat_np_view(events.TrigObj.pt, axis=1),
+        flat_np_view(events.TrigObj.filterBits, axis=1),
+        leg_table.has_pdg_id, leg_table.pdg_id, leg_table.has_min_pt, leg_table.min_pt,
+        leg_table.trigger_bits, leg_table.n_bits,
+        leg_mask, leg_any,
+    )
+
+    # local index of each flat TrigObj to convert masks into index lists
+    local_index = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], counts)
+    masks, indices = [], []
+    for leg in range(n_legs):
+        masks.append(ak.unflatten(leg_mask[leg], counts))
+        indices.append(ak.unflatten(local_index[leg_mask[leg]], segment_sum(leg_mask[leg], offsets)))
+    return masks, indices, leg_any
+
+
 @selector(
     uses={
         # nano columns
@@ -66,6 +145,13 @@ def trigger_selection(
     """
     HLT trigger path selection.
     """
+    #The leg matching engine is chosen in the config, both engines give identical results
+    leg_matcher = self.config_inst.x("trigger_leg_matcher", "awkward")
+    if leg_matcher not in ("awkward", "numba"):
+        raise ValueError(f"unknown trigger_leg_matcher '{leg_matcher}', expected 'awkward' or 'numba'")
+    if leg_matcher == "numba":
+        return trigger_selection_numba(self, events)
+
     any_fired = False
     trigger_data = []
     trigger_ids = []
@@ -133,6 +219,47 @@ def trigger_selection(
     )
 
 
+def trigger_selection_numba(self: Selector, events: ak.Array) -> tuple[ak.Array, SelectionResult]:
+    """
+    Same as :py:func:`trigger_selection`, but all legs of all triggers are matched at once by
+    :py:func:`match_trigger_legs` using the leg table built in the init.
+    """
+    leg_masks_all, leg_indices_all, leg_any = match_trigger_legs(events, self.leg_table)
+
+    any_fired = np.zeros(len(events), dtype=np.bool_)
+    trigger_data = []
+    trigger_ids = []
+    for i, trigger in enumerate(self.triggers):
+        # get bare decisions
+        fired = np.asarray(events.HLT[trigger.hlt_field] == 1)
+        any_fired = any_fired | fired
+
+        # at least one object must match each leg of the trigger
+        legs = slice(self.leg_table.leg_start[i], self.leg_table.leg_start[i + 1])
+        fired_and_all_legs_match = fired & np.logical_and.reduce(leg_any[legs], axis=0)
+
+        # store all intermediate results for subsequent selectors
+        trigger_data.append((trigger, fired_and_all_legs_match, leg_indices_all[legs]))
+        # store the trigger id
+        ids = ak.where(fired_and_all_legs_match, np.float32(trigger.id), np.float32(np.nan))
+        trigger_ids.append(ak.singletons(ak.nan_to_none(ids)))
+
+    # store the fired trigger ids
+    trigger_ids = ak.concatenate(trigger_ids, axis=1)
+    events = set_ak_column(events, "trigger_ids", trigger_ids, value_type=np.int32)
+
+    return events, SelectionResult(
+        steps={
+            "trigger": any_fired,
+        },
+        aux={
+            "trigger_data"  : trigger_data,
+            "trig_obj_idx"  : leg_indices_all,
+            "trig_obj_mask" : leg_masks_all,
+        },
+    )
+
+
 @trigger_selection.init
 def trigger_selection_init(self: Selector) -> None:
     if getattr(self, "dataset_inst", None) is None:
@@ -143,15 +270,138 @@ def trigger_selection_init(self: Selector) -> None:
         for trigger in self.config_inst.x.triggers
         if trigger.applies_to_dataset(self.dataset_inst)
     }
+    #Lookup tables of all legs for the compiled trigger leg matcher, built once per dataset
+    self.triggers = [
+        trigger for trigger in self.config_inst.x.triggers
+        if trigger.applies_to_dataset(self.dataset_inst)
+    ]
+    self.leg_table = build_leg_table(self.triggers)
     
 
 
+def _match_pair_to_trig_objs(offsets, obj_eta, obj_phi, leg_mask, leg_target,
+                             lep_has, lep_eta, lep_phi, max_dr, n_phi,
+                             matched, leg_matched):
+    # numba kernel, compiled on first use via higgs_cp.util.jit
+    cell_phi = 2 * np.pi / n_phi
+    lep_ieta = np.zeros(2, dtype=np.int64)
+    lep_iphi = np.zeros(2, dtype=np.int64)
+    for evt in range(len(offsets) - 1):
+        # eta-phi cells of the pair muon (0) and tau (1)
+        for t in range(2):
+            if lep_has[t, evt]:
+                lep_ieta[t] = np.int64(np.floor(lep_eta[t, evt] / max_dr))
+                lep_iphi[t] = np.int64(np.floor((lep_phi[t, evt] + np.pi) / cell_phi)) % n_phi
+        for j in range(offsets[evt], offsets[evt + 1]):
+            ieta = np.int64(np.floor(obj_eta[j] / max_dr))
+            iphi = np.int64(np.floor((obj_phi[j] + np.pi) / cell_phi)) % n_phi
+            for leg in range(len(leg_target)):
+                t = leg_target[leg]
+                if t < 0 or not leg_mask[leg, j] or not lep_has[t, evt]:
+                    continue
+                # only objects in the same or a neighboring cell can be closer than max_dr
+                if abs(ieta - lep_ieta[t]) > 1:
+                    continue
+                diphi = abs(iphi - lep_iphi[t])
+                if diphi > 1 and diphi < n_phi - 1:
+                    continue
+                # same arithmetic as coffea's delta_r of Lorentz vectors, a numba ufunc that also
+                # computes delta_phi with the float64 np.pi, which gives bit-identical values as
+                # checked by scripts/check_trigger_matching.py, float32 constants would not
+                deta = obj_eta[j] - lep_eta[t, evt]
+                dphi = np.float32((obj_phi[j] - lep_phi[t, evt] + np.pi) % (2 * np.pi) - np.pi)
+                if np.hypot(deta, dphi) < max_dr:
+                    matched[leg, j] = True
+                    leg_matched[leg, evt] = True
+
+
+def match_pair_to_trigger_legs(
+    events: ak.Array,
+    pair_mu_idx: ak.Array,
+    pair_tau_idx: ak.Array,
+    trigger_results: SelectionResult,
+    max_dr: float = 0.5,
+    context: SelectionContext | None = None,
+) -> tuple[np.ndarray, list, np.ndarray, np.ndarray]:
+    """
+    Matches the pair muon and tau to the trigger objects of all legs in *trigger_results* in a
+    single compiled pass over the flat ``TrigObj`` buffers. Legs with pdg id 13 are matched to the
+    muon and legs with pdg id 15 to the tau, other legs are not matched. In addition, the pair
+    muon is matched to the objects of the first leg, as done by the awkward engine of
+    :py:func:`trigger_matching`. Trigger objects are binned in eta-phi cells of size *max_dr* per
+    event and delta R is only computed for objects in the cell of the lepton or in a neighboring
+    one. The pair leptons are taken from the selection *context* when given.
+
+    Returns the per trigger mask of events where the trigger fired and all its muon and tau legs
+    are matched (shape (triggers, events)), the jagged indices of matched trigger objects per leg,
+    the per leg mask of events with at least one matched object (shape (legs, events)) and the
+    mask of events whose pair muon is matched to an object of the first leg.
+    """
+    trigger_data = trigger_results.x.trigger_data
+    legs = [leg for trigger, _, _ in trigger_data for leg in trigger.legs]
+    leg_target = np.array([{13: 0, 15: 1}.get(leg.pdg_id, -1) for leg in legs] + [0], dtype=np.int64)
+
+    counts = np.asarray(ak.num(events.TrigObj.eta, axis=1))
+    offsets = offsets_from_counts(counts)
+    trig_obj_mask = trigger_results.x.trig_obj_mask
+    leg_mask = np.stack([flat_np_view(mask, axis=1) for mask in [*trig_obj_mask, trig_obj_mask[0]]])
+
+    # eta and phi of the pair leptons, flagged by lep_has for events that have a pair
+    lep_has = np.zeros((2, len(events)), dtype=np.bool_)
+    lep_eta = np.zeros((2, len(events)), dtype=np.float32)
+    lep_phi = np.zeros((2, len(events)), dtype=np.float32)
+    if context is not None:
+        #The context refers to the pairs before the vetoes, so only consider events that kept their pair
+        for t, lep in enumerate([context.pair_muon, context.pair_tau]):
+            lep_has[t] = np.asarray(~ak.is_none(lep)) & context.has_pair(pair_mu_idx)
+            lep_eta[t] = np.asarray(ak.fill_none(lep.eta, 0.0), dtype=np.float32)
+            lep_phi[t] = np.asarray(ak.fill_none(lep.phi, 0.0), dtype=np.float32)
+    else:
+        for t, (coll, idx) in enumerate([(events.Muon, pair_mu_idx), (events.Tau, pair_tau_idx)]):
+            lep_has[t] = np.asarray(ak.num(idx, axis=1) > 0)
+            coll_offsets = offsets_from_counts(np.asarray(ak.num(coll.eta, axis=1)))
+            flat_idx = coll_offsets[:-1][lep_has[t]] + np.asarray(ak.firsts(idx, axis=1)[lep_has[t]])
+            lep_eta[t, lep_has[t]] = flat_np_view(coll.eta, axis=1)[flat_idx]
+            lep_phi[t, lep_has[t]] = flat_np_view(coll.phi, axis=1)[flat_idx]
+
+    matched = np.zeros(leg_mask.shape, dtype=np.bool_)
+    leg_matched = np.zeros((len(legs) + 1, len(events)), dtype=np.bool_)
+    jit(_match_pair_to_trig_objs)(
+        offsets,
+        flat_np_view(events.TrigObj.eta, axis=1),
+        flat_np_view(events.TrigObj.phi, axis=1),
+        leg_mask, leg_target, lep_has, lep_eta, lep_phi,
+        np.float32(max_dr), max(int(np.floor(2 * np.pi / max_dr)), 1),
+        matched, leg_matched,
+    )
+
+    # a trigger is matched when it fired and all its legs that refer to pair leptons are matched
+    trigger_matched = np.zeros((len(trigger_data), len(events)), dtype=np.bool_)
+    leg_start = 0
+    for i, (trigger, fired_and_all_legs_match, _) in enumerate(trigger_data):
+        trigger_legs = range(leg_start, leg_start + trigger.n_legs)
+        trigger_matched[i] = np.asarray(fired_and_all_legs_match, dtype=np.bool_)
+        for leg in trigger_legs:
+            if leg_target[leg] >= 0:
+                trigger_matched[i] &= leg_matched[leg]
+        leg_start += trigger.n_legs
+
+    local_index = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], counts)
+    matched_idx = [
+        ak.unflatten(local_index[leg_matched_objs], segment_sum(leg_matched_objs, offsets))
+        for leg_matched_objs in matched[:-1]
+    ]
+    return trigger_matched, matched_idx, leg_matched[:-1], leg_matched[-1]
+
+
 @selector(
     uses={
         # Muon nano columns
         f"Muon.{var}" for var in [
         "pt", "eta","phi", "dz", "dxy", "mediumId", "pfRelIso04_all",
         ] 
+    } | {
+        f"Tau.{var}" for var in ["eta", "phi"]
     } | {
         f"TrigObj.{var}" for var in [
             "id", "pt", "eta", "phi", "filterBits",
@@ -165,24 +415,57 @@ def trigger_matching(
     pair_mu_idx,
     pair_tau_idx,
     trigger_results,
+    context: SelectionContext | None = None,
     **kwargs,
 ) -> ak.Array :
     empty_indices = ak.zeros_like(1 * events.event, dtype=np.int32)[:, np.newaxis][..., :0]
-    #Prepare the mask for pair muons
-    raw_muon_idx = ak.local_index(events.Muon, axis=1)
-    
-    (buf_idx, _) = ak.broadcast_arrays(ak.firsts(pair_mu_idx,axis=1)[:,np.newaxis],raw_muon_idx)
-    pair_mu_mask = ak.fill_none(buf_idx == raw_muon_idx, False)
-    pair_muons =  ak.with_name(ak.drop_none(ak.mask(events.Muon, pair_mu_mask),
-                                            behavior=coffea.nanoevents.methods.vector.behavior),
-                               "PtEtaPhiMLorentzVector")
+    #The matching engine is chosen in the config, both engines compute the same step, i.e. the pair
+    #muon is matched to an object of the first trigger leg
+    matching_engine = self.config_inst.x("trigger_matching_engine", "awkward")
+    if matching_engine not in ("awkward", "numba"):
+        raise ValueError(f"unknown trigger_matching_engine '{matching_engine}', expected 'awkward' or 'numba'")
+    #Pair leptons are shared with other selectors through the selection context
+    if context is None:
+        context = SelectionContext(events, pair_mu_idx, pair_tau_idx)
+    context.use("trigger_matching")
+    if matching_engine == "numba":
+        #Match pair leptons to all legs of all fired triggers, objects are binned in eta-phi cells,
+        #the per trigger matches are stored in the aux data
+        trigger_matched, matched_trig_obj_idx, leg_matched, is_matched = match_pair_to_trigger_legs(
+            events,
+            pair_mu_idx,
+            pair_tau_idx,
+            trigger_results,
+            context=context,
+        )
+        pair_mu_idx = ak.where(is_matched, pair_mu_idx, empty_indices)
+        pair_tau_idx = ak.where(is_matched, pair_tau_idx, empty_indices)
+        return events, SelectionResult(
+            steps = {
+                "trigger_matching" : is_matched,
+            },
+            objects={
+                "Muon": {
+                    "Muon": pair_mu_idx
+                },
+                "Tau": {
+                    "Tau": pair_tau_idx
+                }
+            },
+            aux={
+                "trigger_matched"      : trigger_matched,
+                "matched_trig_obj_idx" : matched_trig_obj_idx,
+                "trigger_leg_matched"  : leg_matched,
+            },
+        )
     #Preselect TrigObj 
     trig_obj = ak.with_name(ak.drop_none(ak.mask(events.TrigObj, trigger_results.x.trig_obj_mask[0]),
                                          behavior=coffea.nanoevents.methods.vector.behavior),
                             "PtEtaPhiMLorentzVector")
-    (broadcasted_pair_mu, _) = ak.broadcast_arrays(ak.firsts(pair_muons,axis=1)[:,np.newaxis],trig_obj)
+    (broadcasted_pair_mu, _) = ak.broadcast_arrays(context.pair_muon[:,np.newaxis],trig_obj)
     dr_mu2trig  = ak.fill_none(trig_obj.delta_r(broadcasted_pair_mu), 999)
-    is_matched = ak.any(dr_mu2trig < 0.5, axis = 1)
+    #The context refers to the pairs before the vetoes, so only consider events that kept their pair
+    is_matched = ak.any(dr_mu2trig < 0.5, axis = 1) & context.has_pair(pair_mu_idx)
     pair_mu_idx = ak.where(is_matched,
                            pair_mu_idx,
                            empty_indices)
@@ -0,0 +1,334 @@
+# coding: utf-8
+
+"""
+Helpers shared between selectors.
+"""
+
+from __future__ import annotations
+
+import time
+import contextlib
+import tracemalloc
+
+import law
+
+from columnflow.selection import SelectionResult
+from columnflow.util import maybe_import
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+maybe_import("coffea.nanoevents.methods.vector")
+
+logger = law.logger.get_logger(__name__)
+
+
+class SelectionContext(object):
+    """
+    Per-chunk cache of objects derived from the selected mu-tau pair that are needed by several
+    selectors, i.e., local object indices, pair object masks and Lorentz-vector views of the pair
+    and extra muons as well as the pair tau. Each object is created on first access and then
+    handed out again to all subsequent selectors.
+
+    Selectors announce themselves through :py:meth:`use`. Whenever a selector obtains an object
+    that was built for another one, the object and all objects it was derived from are counted in
+    :py:attr:`n_saved` as jagged allocations that did not have to be repeated.
+
+    The context always refers to the pair indices *pair_mu_idx* and *pair_tau_idx* it was created
+    with. Selectors that receive pair indices that were emptied by a veto in the meantime need to
+    combine their result with :py:meth:`has_pair`.
+    """
+
+    def __init__(self, events: ak.Array, pair_mu_idx: ak.Array, pair_tau_idx: ak.Array):
+        super().__init__()
+
+        self.events = events
+        self.pair_mu_idx = pair_mu_idx
+        self.pair_tau_idx = pair_tau_idx
+
+        self.consumer = None
+        self.n_built = 0
+        self.n_saved = 0
+        self._cache = {}
+        self._deps = {}
+        self._users = {}
+        self._building = []
+
+    def use(self, consumer: str) -> SelectionContext:
+        """
+        Sets the name of the selector that *consumes* the objects from now on and returns *self*.
+        """
+        self.consumer = consumer
+        return self
+
+    def _claim(self, name: str) -> int:
+        # mark the object and its dependencies as used by the current consumer and count them
+        if self.consumer in self._users[name]:
+            return 0
+        self._users[name].add(self.consumer)
+        return 1 + sum(self._claim(dep) for dep in self._deps[name])
+
+    def _get(self, name: str, func) -> ak.Array:
+        if self._building:
+            self._deps[self._building[-1]].add(name)
+        if name not in self._cache:
+            self._deps[name] = set()
+            self._building.append(name)
+            try:
+                self._cache[name] = func()
+            finally:
+                self._building.pop()
+            self._users[name] = {self.consumer}
+            self.n_built += 1
+        else:
+            self.n_saved += self._claim(name)
+        return self._cache[name]
+
+    @staticmethod
+    def _pair_mask(pair_idx: ak.Array, raw_idx: ak.Array) -> ak.Array:
+        (buf_idx, _) = ak.broadcast_arrays(ak.firsts(pair_idx, axis=1)[:, np.newaxis], raw_idx)
+        return ak.fill_none(buf_idx == raw_idx, False)
+
+    @staticmethod
+    def _lorentz_view(objects: ak.Array, mask: ak.Array) -> ak.Array:
+        return ak.with_name(ak.drop_none(ak.mask(objects, mask),
+                                         behavior=coffea.nanoevents.methods.vector.behavior),
+                            "PtEtaPhiMLorentzVector")
+
+    @staticmethod
+    def has_pair(pair_mu_idx: ak.Array) -> np.ndarray:
+        """
+        Returns a mask of events that still have a selected pair according to *pair_mu_idx*.
+        """
+        return np.asarray(ak.num(pair_mu_idx, axis=1) > 0)
+
+    @property
+    def muon_local_index(self) -> ak.Array:
+        return self._get("muon_local_index", lambda: ak.local_index(self.events.Muon, axis=1))
+
+    @property
+    def tau_local_index(self) -> ak.Array:
+        return self._get("tau_local_index", lambda: ak.local_index(self.events.Tau, axis=1))
+
+    @property
+    def pair_mu_mask(self) -> ak.Array:
+        return self._get("pair_mu_mask",
+                         lambda: self._pair_mask(self.pair_mu_idx, self.muon_local_index))
+
+    @property
+    def pair_tau_mask(self) -> ak.Array:
+        return self._get("pair_tau_mask",
+                         lambda: self._pair_mask(self.pair_tau_idx, self.tau_local_index))
+
+    @property
+    def pair_muons(self) -> ak.Array:
+        return self._get("pair_muons",
+                         lambda: self._lorentz_view(self.events.Muon, self.pair_mu_mask))
+
+    @property
+    def extra_muons(self) -> ak.Array:
+        return self._get("extra_muons",
+                         lambda: self._lorentz_view(self.events.Muon, ~self.pair_mu_mask))
+
+    @property
+    def pair_taus(self) -> ak.Array:
+        return self._get("pair_taus",
+                         lambda: self._lorentz_view(self.events.Tau, self.pair_tau_mask))
+
+    @property
+    def pair_muon(self) -> ak.Array:
+        """
+        The pair muon per event, or *None* for events without a pair.
+        """
+        return self._get("pair_muon", lambda: ak.firsts(self.pair_muons, axis=1))
+
+    @property
+    def pair_tau(self) -> ak.Array:
+        """
+        The pair tau per event, or *None* for events without a pair.
+        """
+        return self._get("pair_tau", lambda: ak.firsts(self.pair_taus, axis=1))
+
+
+class StepProfiler(object):
+    """
+    Records the wall time, the peak memory allocated and the number of input and output events of
+    each sub-selector call. Steps are profiled with
+
+    .. code-block:: python
+
+        profiler = StepProfiler(results, enabled=True)
+        with profiler("jet_veto", events):
+            events, jet_veto_results = self[jet_veto](events, **kwargs)
+            results += jet_veto_results
+
+    Input and output events are those passing all *results.steps* known before and after the call,
+    so *results* must be updated in-place within the block. The memory is the peak traced by
+    tracemalloc during the step on top of the memory allocated before it. Tracing is started for the
+    step unless it is already running, e.g. in a benchmark. When *enabled* is *False*, nothing is
+    measured. :py:meth:`fill` adds the records to the selection stats under ``"selection_profile"``
+    as plain sums, so that they are merged across chunks like all other counts.
+    """
+
+    def __init__(self, results, enabled: bool = True):
+        super().__init__()
+
+        self.results = results
+        self.enabled = enabled
+        self.records = {}
+
+    def _n_passed(self, n_events: int) -> int:
+        steps = list(self.results.steps.values())
+        if not steps:
+            return n_events
+        return int(np.sum(np.logical_and.reduce([np.asarray(step) for step in steps])))
+
+    @contextlib.contextmanager
+    def __call__(self, step: str, events: ak.Array):
+        if not self.enabled:
+            yield
+            return
+
+        n_in = self._n_passed(len(events))
+        # an outer trace is kept running, only the peak is reset for the step
+        start_tracing = not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        t_in = time.perf_counter()
+        try:
+            yield
+            t_out = time.perf_counter()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if start_tracing:
+                tracemalloc.stop()
+
+        record = self.records.setdefault(step, {
+            "n_calls": 0, "time": 0.0, "peak_memory": 0, "n_in": 0, "n_out": 0,
+        })
+        record["n_calls"] += 1
+        record["time"] += t_out - t_in
+        record["peak_memory"] += peak - current
+        record["n_in"] += n_in
+        record["n_out"] += self._n_passed(len(events))
+
+    def derive(self, results) -> StepProfiler:
+        """
+        Returns a profiler adding to the same records that counts the events passing the steps of
+        other *results*, e.g. of selectors that run on a subset of the events.
+        """
+        profiler = self.__class__(results, enabled=self.enabled)
+        profiler.records = self.records
+        return profiler
+
+    def fill(self, stats: dict) -> None:
+        """
+        Adds all records to the selection *stats* and logs them.
+        """
+        if not self.enabled:
+            return
+
+        profile = stats.setdefault("selection_profile", {})
+        for step, record in self.records.items():
+            logger.info(
+                f"{step}: {record['time']:.3f}s, peak memory +{record['peak_memory'] / 1024**2:.1f} MB, "
+                f"events {record['n_in']} -> {record['n_out']}",
+            )
+            if step not in profile:
+                profile[step] = dict(record)
+            else:
+                for key, value in record.items():
+                    profile[step][key] += value
+
+
+def _take_events(obj, mask: np.ndarray):
+    # recursively select events in arrays and in containers of arrays, other objects are kept
+    if isinstance(obj, (ak.Array, np.ndarray)):
+        return obj[mask]
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_take_events(o, mask) for o in obj)
+    if isinstance(obj, dict):
+        return type(obj)((key, _take_events(o, mask)) for key, o in obj.items())
+    return obj
+
+
+def take_events(result: SelectionResult, mask: np.ndarray) -> SelectionResult:
+    """
+    Returns a new selection *result* restricted to the events in *mask*, including all arrays in its
+    auxiliary data, so that it can be passed to selectors that run on ``events[mask]`` only.
+    """
+    return SelectionResult(
+        event=None if result.event is None else result.event[mask],
+        steps=_take_events(dict(result.steps), mask),
+        objects=_take_events(dict(result.objects), mask),
+        aux=_take_events(dict(result.aux), mask),
+    )
+
+
+def scatter_indices(indices: ak.Array, mask: np.ndarray) -> ak.Array:
+    """
+    Expands jagged object *indices* of the events in *mask* to all events, where events not in
+    *mask* receive empty lists.
+    """
+    counts = np.zeros(len(mask), dtype=np.int64)
+    counts[mask] = ak.num(indices, axis=1)
+    return ak.unflatten(ak.flatten(indices, axis=1), counts)
+
+
+def scatter_events(result: SelectionResult, mask: np.ndarray, fill_steps: bool = False) -> SelectionResult:
+    """
+    Expands a selection *result* obtained on ``events[mask]`` to all events. The event mask is
+    *False* and object indices are empty for events not in *mask*. Steps are set to *fill_steps*
+    for these events, i.e. *True* when they are already rejected by other steps, so that the
+    combined selection and the cumulative cutflow are the same as if the selectors had run on all
+    events and the steps only count rejections among the events in *mask*. Auxiliary data refers
+    to the events in *mask* and is kept as is.
+    """
+    def scatter_mask(sub_mask, fill=False):
+        full_mask = np.full(len(mask), fill, dtype=np.bool_)
+        full_mask[mask] = sub_mask
+        return full_mask
+
+    return SelectionResult(
+        event=None if result.event is None else scatter_mask(result.event),
+        steps={step: scatter_mask(sub_mask, fill_steps) for step, sub_mask in result.steps.items()},
+        objects={
+            src: {dst: scatter_indices(indices, mask) for dst, indices in dsts.items()}
+            for src, dsts in result.objects.items()
+        },
+        aux=dict(result.aux),
+    )
+
+
+def sum_per_process(
+    process_id: np.ndarray,
+    weights: np.ndarray,
+    mask: np.ndarray | None = None,
+    max_span: int = 1 << 16,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sums *weights* of events in *mask* per process in a single pass. Process ids are mapped to a
+    dense index so that the sums are obtained with one ``np.bincount``. When the ids span less
+    than *max_span* values, the index is simply the offset to the smallest id, otherwise it is
+    obtained with ``np.unique``. Returns the unique process ids of all events and the
+    corresponding sums, which are zero for processes without events in *mask*.
+    """
+    process_id = np.asarray(process_id)
+    weights = np.asarray(weights, dtype=np.float64)
+    if mask is not None:
+        weights = np.where(np.asarray(mask), weights, 0.0)
+    if len(process_id) == 0:
+        return process_id[:0], weights[:0]
+
+    lo = process_id.min()
+    if process_id.max() - lo < max_span:
+        dense_idx = (process_id - lo).astype(np.intp)
+        present = np.bincount(dense_idx) > 0
+        sums = np.bincount(dense_idx, weights=weights)
+        return np.flatnonzero(present).astype(process_id.dtype) + lo, sums[present]
+
+    unique_ids, dense_idx = np.unique(process_id, return_inverse=True)
+    return unique_ids, np.bincount(dense_idx, weights=weights, minlength=len(unique_ids))
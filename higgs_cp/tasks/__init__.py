@@ -3,3 +3,4 @@
 
 # provisioning imports
 import higgs_cp.tasks.base
+import higgs_cp.tasks.benchmark
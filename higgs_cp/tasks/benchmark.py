@@ -0,0 +1,125 @@
+# coding: utf-8
+
+"""
+Task measuring the throughput of the calibrator, selector and producer on synthetic chunks.
+"""
+
+import time
+from collections import defaultdict
+
+import luigi
+import law
+
+from columnflow.tasks.framework.base import DatasetTask
+from columnflow.tasks.framework.mixins import CalibratorMixin, SelectorMixin, ProducerMixin
+from columnflow.util import dev_sandbox, DotDict
+from higgs_cp.tasks.base import HIGGS_CPTask
+
+
+class BenchmarkColumnar(
+    HIGGS_CPTask,
+    CalibratorMixin,
+    SelectorMixin,
+    ProducerMixin,
+    DatasetTask,
+):
+    """
+    Runs the calibrator, the selector and the producer, e.g. ``main``, ``default`` and
+    ``default``, on synthetic chunks of the configured *sizes* built by
+    :py:func:`higgs_cp.benchmark.synthetic.make_chunk` from the columns they use, and stores the
+    events per second and the peak memory per function and size in a json file for regression
+    tracking, together with the feature flags of the config, see
+    :py:data:`higgs_cp.config.util.feature_flags`, and the load times and reuses of the shared
+    correction sets. The producer runs on reduced chunks with one muon and one tau per event. External
+    files and other requirements of the functions are resolved as in the columnflow tasks, the
+    event content does not depend on input files. To run without access to the external files,
+    point HIGGS_CP_EXTERNAL_REPLICAS to local replicas, see scripts/make_external_replicas.py.
+
+    .. code-block:: bash
+
+        law run higgs_cp.BenchmarkColumnar --version bench --dataset dy_lep_madgraph \\
+            --calibrator main --sizes 10000,100000,1000000
+    """
+
+    sizes = law.CSVParameter(
+        cls=luigi.IntParameter,
+        default=(10_000, 100_000, 1_000_000),
+        description="numbers of events of the synthetic chunks; default: 10000,100000,1000000",
+    )
+    n_repeat = luigi.IntParameter(
+        default=3,
+        significant=False,
+        description="number of timed calls per function and size, the best one is reported; "
+        "default: 3",
+    )
+    seed = luigi.IntParameter(
+        default=42,
+        description="seed of the synthetic chunks; default: 42",
+    )
+
+    # default sandbox, the same as for the columnflow tasks running the functions
+    sandbox = dev_sandbox(law.config.get("analysis", "default_columnar_sandbox"))
+
+    def requires(self):
+        # requirements of the functions, e.g. external files
+        return {
+            stage: law.util.make_unique(law.util.flatten(inst.run_requires()))
+            for stage, inst in self.array_function_insts.items()
+        }
+
+    @property
+    def array_function_insts(self):
+        return {
+            "calibration": self.calibrator_inst,
+            "selection": self.selector_inst,
+            "production": self.producer_inst,
+        }
+
+    def output(self):
+        return self.target(f"benchmark__seed{self.seed}.json")
+
+    @law.decorator.log
+    @law.decorator.safe_output
+    def run(self):
+        from higgs_cp.benchmark.harness import benchmark, environment
+        from higgs_cp.corrections import correction_registry_stats
+        from higgs_cp.config.util import feature_flags
+
+        # run the setup of all functions
+        for inst in self.array_function_insts.values():
+            reqs = inst.run_requires()
+            inst.run_setup(reqs, luigi.task.getpaths(reqs))
+
+        # the events of all chunks belong to the first process of the dataset
+        constants = {"process_id": self.dataset_inst.processes.get_first().id}
+        calls = {
+            "calibration": lambda events: self.calibrator_inst(events),
+            "selection": lambda events: self.selector_inst(events, defaultdict(float), hists=DotDict()),
+            "production": lambda events: self.producer_inst(events),
+        }
+
+        results = []
+        for stage, inst in self.array_function_insts.items():
+            # the producer runs after the reduction
+            results += benchmark(
+                f"{stage}:{inst.cls_name}",
+                calls[stage],
+                inst.used_columns,
+                self.sizes,
+                n_repeat=self.n_repeat,
+                seed=self.seed,
+                reduced=stage == "production",
+                constants=constants,
+            )
+
+        self.output().dump({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": self.config_inst.name,
+            "dataset": self.dataset_inst.name,
+            "environment": environment(),
+            # engines and modes the functions ran with
+            "feature_flags": {name: self.config_inst.x(name, None) for name in feature_flags},
+            "results": results,
+            # load times and reuses of the correction sets shared by the functions
+            "correction_sets": correction_registry_stats(),
+        }, indent=4, formatter="json")
@@ -0,0 +1,90 @@
+# coding: utf-8
+
+"""
+Collection of general helpers shared by selectors, calibrators and producers.
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import, memoize
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+numba = maybe_import("numba")
+
+
+@memoize
+def jit(func):
+    """
+    Returns the numba-compiled version of a kernel *func*. Kernels are defined as plain functions
+    and only compiled on first use, so that modules defining them can still be imported outside of
+    the columnar sandbox where numba is not available.
+    """
+    return numba.njit(func)
+
+
+def offsets_from_counts(counts: np.ndarray) -> np.ndarray:
+    """
+    Converts per-event *counts* into an offsets array of length ``len(counts) + 1``.
+    """
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def segment_sum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Sums flat *values* within the segments defined by *offsets*, also for empty segments.
+    """
+    csum = np.zeros(len(values) + 1, dtype=np.int64 if values.dtype == bool else values.dtype)
+    np.cumsum(values, out=csum[1:])
+    return csum[offsets[1:]] - csum[offsets[:-1]]
+
+
+def flat_content(array: ak.Array) -> tuple[ak.index.Index, np.ndarray]:
+    """
+    Returns the offsets and a numpy view of the flat content of a singly jagged *array*. The
+    content is not copied when the array is a list offset layout starting at zero and covering its
+    full content, which is the case for columns read from file, otherwise the layout is rebuilt
+    once in this form.
+    """
+    layout = ak.to_layout(array)
+    if isinstance(layout, (ak.contents.ListOffsetArray, ak.contents.ListArray)):
+        layout = layout.to_ListOffsetArray64(True)
+        if len(layout.content) != layout.offsets[-1]:
+            layout = ak.contents.ListOffsetArray(
+                layout.offsets,
+                layout.content[:layout.offsets[-1]],
+            )
+    else:
+        layout = ak.to_layout(ak.unflatten(ak.flatten(array, axis=1), ak.num(array, axis=1)))
+    return layout.offsets, np.asarray(layout.content.data)
+
+
+def jagged_from_offsets(offsets: ak.index.Index, values: np.ndarray) -> ak.Array:
+    """
+    Wraps flat *values* into a jagged array that shares the *offsets* buffer obtained from
+    :py:func:`flat_content`, without copying either of them.
+    """
+    return ak.Array(ak.contents.ListOffsetArray(offsets, ak.contents.NumpyArray(values)))
+
+
+def first_flat_index(array: ak.Array) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns a mask of events with at least one object in the singly jagged *array* and the indices
+    of their first objects in the flat content of *array*.
+    """
+    counts = np.asarray(ak.num(array, axis=1))
+    has_object = counts > 0
+    return has_object, offsets_from_counts(counts)[:-1][has_object]
+
+
+# abcd region codes of the existing categories, the code is 2 * isolation bin + (same sign pair),
+# i.e. iso bin 0 is the isolated region and bin 1 the first sideband of cfg.x.abcd_iso_edges
+abcd_regions = {
+    "cat_d" : 0,  # isolated, opposite sign
+    "cat_c" : 1,  # isolated, same sign
+    "cat_b" : 2,  # first sideband, opposite sign
+    "cat_a" : 3,  # first sideband, same sign
+}
@@ -0,0 +1,36 @@
+# coding: utf-8
+
+"""
+Event weight producer reading the precomputed product of all event weights.
+"""
+
+from columnflow.weight import WeightProducer, weight_producer
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+@weight_producer(
+    uses={"total_weight"},
+    # only run on mc
+    mc_only=True,
+)
+def precomputed_weight(self: WeightProducer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    WeightProducer returning the total_weight column written by the total_weight producer, i.e.
+    the product of all weights in the *event_weights* aux entry of the config. For shifts that the
+    weights depend on, total_weight refers to the shifted total weight through the column aliases
+    added by :py:func:`higgs_cp.config.util.add_total_weight_aliases`.
+    """
+    return events, events.total_weight
+
+
+@precomputed_weight.init
+def precomputed_weight_init(self: WeightProducer) -> None:
+    if not getattr(self, "dataset_inst", None):
+        return
+
+    # declare the shifts that the total weight depends on
+    for shift_insts in self.config_inst.x("event_weights", {}).values():
+        self.shifts |= {shift_inst.name for shift_inst in shift_insts}
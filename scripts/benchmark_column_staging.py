@@ -0,0 +1,123 @@
+"""
+Compares the column writes of the producers whose columns are staged in the default producer, i.e.
+pu_weight, muon_weight, tau_weight, dilepton_mass and mT, between setting each column right away
+(sequential) and inserting all of them at once (staged, cfg.x.producer_column_staging). The
+producers run on a synthetic chunk of reduced events with a comparable number of columns, the
+tables and corrections are replaced by synthetic ones. Checks that both modes produce identical
+events and reports the time and the memory allocated by the column writes (traced with
+tracemalloc).
+
+Usage: python scripts/benchmark_column_staging.py [n_events]
+"""
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+import awkward as ak
+
+from columnflow.util import DotDict
+from higgs_cp.production.util import ColumnStage
+from higgs_cp.production.weights import pu_weight, muon_weight, tau_weight, tau_sf_classes
+from higgs_cp.production.mutau_vars import dilepton_mass, mT
+
+
+class AuxData(DotDict):
+    # auxiliary config data, accessed both as attributes and with cfg.x(name, default)
+
+    def __call__(self, name, default=None):
+        return self.get(name, default)
+
+
+class IDCorrector(object):
+
+    def __init__(self, syst_arg):
+        super().__init__()
+        self.syst_arg = syst_arg
+
+    def evaluate(self, *args):
+        scale = {"nom": 1.0, "up": 1.1, "down": 0.9}[args[self.syst_arg]]
+        return (scale * np.cos(args[0]) ** 2).astype(np.float32)
+
+
+def make_inst(rng):
+    x = AuxData(lepton_weights_pair_only=True, deep_tau=DotDict(vs_jet="Medium", vs_e="VVLoose", vs_mu="Tight"))
+    tau_flav_class = np.zeros(256, dtype=np.int64)
+    for i, flavs in enumerate(tau_sf_classes.values(), 1):
+        tau_flav_class[list(flavs)] = i
+    return SimpleNamespace(
+        dataset_inst=SimpleNamespace(is_mc=True, is_data=False),
+        config_inst=SimpleNamespace(x=x),
+        pu_edges=np.arange(100, dtype=np.float64),
+        pu_weights=rng.uniform(0.5, 1.5, (3, 99)),
+        pu_columns=["pu_weight", "pu_weight_minbias_xs_up", "pu_weight_minbias_xs_down"],
+        muon_sf_edges=(np.linspace(20, 200, 10), np.linspace(-2.4, 2.4, 5)),
+        muon_sf_values=rng.uniform(0.9, 1.1, (3, 9, 4)),
+        muon_sf_columns=["muon_weight", "muon_weight_up", "muon_weight_down"],
+        id_vs_jet_corrector=IDCorrector(5),
+        id_vs_e_corrector=IDCorrector(4),
+        id_vs_mu_corrector=IDCorrector(3),
+        tau_flav_class=tau_flav_class,
+    )
+
+
+def make_events(n_events, rng):
+    counts = np.ones(n_events, dtype=np.int64)
+
+    def collection(names, extra={}):
+        fields = {name: rng.uniform(0.1, 2.0, n_events).astype(np.float32) for name in names}
+        fields.update(extra)
+        return ak.zip({name: ak.unflatten(value, counts) for name, value in fields.items()})
+
+    kin = ["pt", "eta", "phi", "mass", "dxy", "dz", "pfRelIso04_all"]
+    muon = collection(kin)
+    muon = ak.with_field(muon, muon.pt * 30, "pt")
+    tau_extra = {"genPartFlav": rng.integers(0, 6, n_events).astype(np.uint8),
+                 "decayMode": rng.choice([0, 1, 10, 11], n_events).astype(np.int32)}
+    tau = collection(kin + [f"{var}{tag}" for var in ["pt", "mass"]
+                            for tag in ["_no_tes", "_tes_up", "_tes_down"]], tau_extra)
+    columns = {f"column_{i}": rng.random(n_events).astype(np.float32) for i in range(40)}
+    return ak.Array({
+        **columns,
+        "Muon": muon,
+        "Tau": tau,
+        "PuppiMET": ak.zip({name: rng.random(n_events).astype(np.float32) for name in ["pt", "phi"]}),
+        "Pileup": ak.zip({"nTrueInt": rng.uniform(0, 99, n_events).astype(np.float32)}),
+    })
+
+
+def produce(inst, events, enabled):
+    stage = ColumnStage(enabled=enabled, profile=True)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for func in [pu_weight, muon_weight, tau_weight, dilepton_mass, mT]:
+        events = func.call_func(inst, events, stage=stage)
+    events = stage.flush(events)
+    duration = time.perf_counter() - t0
+    tracemalloc.stop()
+    return events, duration, stage
+
+
+def main(n_events=100_000):
+    rng = np.random.default_rng(42)
+    inst = make_inst(rng)
+    events = make_events(n_events, rng)
+    # compile the kernels outside of the measurement
+    produce(inst, events[:10], False)
+
+    sequential, t_seq, stage_seq = produce(inst, events, False)
+    staged, t_staged, stage_staged = produce(inst, events, True)
+
+    assert sorted(sequential.fields) == sorted(staged.fields)
+    for field in sequential.fields:
+        assert ak.all(ak.flatten(sequential[field], axis=None) == ak.flatten(staged[field], axis=None)), field
+    assert sorted(sequential.Muon.fields) == sorted(staged.Muon.fields)
+    print(f"{n_events} events, {stage_staged.n_columns} columns, identical outputs")
+    print(f"{'':>10} {'time [ms]':>10} {'column writes [MB]':>19}")
+    print(f"{'sequential':>10} {t_seq * 1e3:>10.1f} {stage_seq.n_bytes / 1024**2:>19.1f}")
+    print(f"{'staged':>10} {t_staged * 1e3:>10.1f} {stage_staged.n_bytes / 1024**2:>19.1f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,54 @@
+"""
+Compares the per-process weight sums of custom_increment_stats, i.e. the former loop over unique
+process ids with one mask per process against the single-pass sum_per_process, on synthetic
+chunks with 2, 20 and 200 process ids.
+
+Usage: python scripts/benchmark_increment_stats.py [n_events] [n_repeat]
+"""
+import sys
+import time
+
+import numpy as np
+import awkward as ak
+
+from higgs_cp.selection.util import sum_per_process
+
+
+def sum_per_process_loop(process_id, weights, mask):
+    sums = {}
+    for p in np.unique(process_id):
+        sums[int(p)] = ak.sum(weights[(process_id == p) & mask])
+    return sums
+
+
+def sum_per_process_bincount(process_id, weights, mask):
+    unique_ids, sums = sum_per_process(process_id, weights, mask)
+    return dict(zip(unique_ids.tolist(), sums.tolist()))
+
+
+def best_time(func, args, n_repeat):
+    times = []
+    for _ in range(n_repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main(n_events=100_000, n_repeat=5):
+    rng = np.random.default_rng(42)
+    weights = ak.Array(np.sign(rng.normal(1, 1, n_events)).astype(np.float32))
+    mask = rng.random(n_events) < 0.3
+    print(f"{'n_proc':>7} {'loop [ms]':>10} {'bincount [ms]':>14} {'speedup':>8} {'max abs diff':>13}")
+    for n_proc in [2, 20, 200]:
+        # sparse process ids, like the ones of the dy split
+        process_id = rng.choice(51000 + np.arange(n_proc) * 7, n_events).astype(np.int64)
+        t_loop, loop = best_time(sum_per_process_loop, (process_id, weights, mask), n_repeat)
+        t_fast, fast = best_time(sum_per_process_bincount, (process_id, weights, mask), n_repeat)
+        assert loop.keys() == fast.keys()
+        diff = max(abs(loop[p] - fast[p]) for p in loop)
+        print(f"{n_proc:>7} {t_loop * 1e3:>10.2f} {t_fast * 1e3:>14.2f} {t_loop / t_fast:>8.1f} {diff:>13.2e}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,118 @@
+"""
+Compares the per-chunk time of the mutau_vars producers called by the default producer in
+cf.ProduceColumns, i.e. dilepton_mass and mT, between the former implementation
+(coffea behavior attached in every producer, vector arithmetic) and the current one (raw columns
+and higgs_cp.production.kinematics). The producers are run on synthetic chunks with the layout of
+reduced events, i.e. one muon and one tau per event, and the outputs are compared. Visible masses
+differ by up to a few percent for nearly collinear pairs, where the former float32 vector
+arithmetic loses precision, while the kinematics kernel computes in float64.
+
+Usage: python scripts/benchmark_mutau_vars.py [n_events] [n_repeat]
+"""
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import awkward as ak
+
+from columnflow.columnar_util import EMPTY_FLOAT, set_ak_column
+from columnflow.production.util import attach_coffea_behavior
+from higgs_cp.production.mutau_vars import dilepton_mass, mT
+
+
+def produce_behavior(events):
+    # former implementation, each producer attaches the behavior again
+    from coffea.nanoevents.methods import vector
+    events = attach_coffea_behavior.call_func(None, events)
+    muon = ak.firsts(events.Muon, axis=1)
+    for tag in ["", "_no_tes", "_tes_up", "_tes_down"]:
+        tau = ak.zip(
+            {
+                "pt": events.Tau[f"pt{tag}"],
+                "eta": events.Tau.eta,
+                "phi": events.Tau.phi,
+                "mass": events.Tau[f"mass{tag}"],
+            },
+            with_name="PtEtaPhiMLorentzVector",
+            behavior=vector.behavior,
+        )
+        mutau_obj = muon + tau
+        mutau_mass = ak.flatten(ak.where(mutau_obj.mass2 >= 0, mutau_obj.mass, EMPTY_FLOAT))
+        events = set_ak_column(events, f"mutau_mass{tag}", mutau_mass, value_type=np.float32)
+    events = attach_coffea_behavior.call_func(None, events)
+    cos_dphi = np.cos(events.Muon.delta_phi(events.PuppiMET))
+    mT_values = np.sqrt(2 * events.Muon.pt * events.PuppiMET.pt * (1 - cos_dphi))
+    mT_values = ak.fill_none(mT_values, EMPTY_FLOAT)
+    events = set_ak_column(events, "Muon.mT", mT_values, value_type=np.float32)
+    return events
+
+
+def produce_raw(events):
+    inst = SimpleNamespace(
+        dataset_inst=SimpleNamespace(is_mc=True, is_data=False),
+    )
+    events = dilepton_mass.call_func(inst, events)
+    events = mT.call_func(inst, events)
+    return events
+
+
+def make_events(n_events, seed=42):
+    rng = np.random.default_rng(seed)
+    counts = np.ones(n_events, dtype=np.int64)
+
+    def collection(fields):
+        return ak.zip({
+            name: ak.unflatten(func(n_events).astype(dtype), counts)
+            for name, (func, dtype) in fields.items()
+        })
+
+    kin = {
+        "pt": (lambda n: rng.exponential(30, n) + 20, np.float32),
+        "eta": (lambda n: rng.uniform(-2.4, 2.4, n), np.float32),
+        "phi": (lambda n: rng.uniform(-np.pi, np.pi, n), np.float32),
+        "charge": (lambda n: rng.choice([-1, 1], n), np.int32),
+    }
+    muon = collection(kin | {"mass": (lambda n: np.full(n, 0.1057), np.float32)})
+    tau_fields = kin | {"mass": (lambda n: rng.uniform(0.1, 1.7, n), np.float32)}
+    tau = collection(tau_fields)
+    for tag, scale in [("_no_tes", 1.0), ("_tes_up", 1.03), ("_tes_down", 0.97)]:
+        tau = ak.with_field(tau, tau.pt * scale, f"pt{tag}")
+        tau = ak.with_field(tau, tau.mass * scale, f"mass{tag}")
+    met = ak.zip({
+        "pt": rng.exponential(30, n_events).astype(np.float32),
+        "phi": rng.uniform(-np.pi, np.pi, n_events).astype(np.float32),
+    })
+    return ak.Array({"Muon": muon, "Tau": tau, "PuppiMET": met})
+
+
+def best_time(func, events, n_repeat):
+    times = []
+    for _ in range(n_repeat):
+        t0 = time.perf_counter()
+        result = func(events)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main(n_events=100_000, n_repeat=3):
+    events = make_events(n_events)
+    # compile the kernels outside of the measurement
+    produce_raw(events[:10])
+
+    t_old, old = best_time(produce_behavior, events, n_repeat)
+    t_new, new = best_time(produce_raw, events, n_repeat)
+
+    for column in ["mutau_mass", "mutau_mass_no_tes", "mutau_mass_tes_up", "mutau_mass_tes_down", "Muon.mT"]:
+        diff = np.abs(np.asarray(ak.flatten(new[tuple(column.split("."))], axis=None), dtype=np.float64) -
+                      np.asarray(ak.flatten(old[tuple(column.split("."))], axis=None), dtype=np.float64))
+        print(f"{column}: max abs. difference {np.max(diff):.2e}, median {np.median(diff):.2e}")
+
+    print(f"{n_events} events per chunk")
+    print(f"{'':>9} {'time [ms]':>10}")
+    print(f"{'behavior':>9} {t_old * 1e3:>10.1f}")
+    print(f"{'raw':>9} {t_new * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
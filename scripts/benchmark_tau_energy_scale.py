@@ -0,0 +1,115 @@
+"""
+Compares the former tau_energy_scale implementation (flatten and unflatten of every column)
+with the current one (flat content and shared offsets) on a synthetic chunk. Checks that both
+produce identical Tau columns, including the up and down variations of the energy scale, and
+reports their run time and the memory allocated by numpy and awkward (traced with tracemalloc).
+The former implementation is run once per variation, as separate calibrator runs would do.
+
+The TES correction is replaced by a deterministic function of pt and decay mode, since only the
+handling of the columns around the correctionlib call is compared.
+
+Usage: python scripts/benchmark_tau_energy_scale.py [n_events]
+"""
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+import awkward as ak
+
+from columnflow.columnar_util import flat_np_view
+from higgs_cp.calibration.tau import tau_energy_scale, set_ak_column_f32
+
+
+class TESCorrector(object):
+
+    shifts = {"nom": 0.0, "up": 0.03, "down": -0.03}
+
+    def evaluate(self, pt, abseta, dm, match, tagger, vs_jet, vs_e, syst):
+        scale = 1.0 + self.shifts[syst] + 0.01 * (dm % 3) - 1e-4 * np.minimum(pt, 100)
+        return scale.astype(np.float32)
+
+
+def tau_energy_scale_flatten(self, events, syst="nom"):
+    # former implementation, shifted columns are obtained by rerunning it with another syst
+    pt = flat_np_view(events.Tau.pt, axis=1)
+    abseta = flat_np_view(abs(events.Tau.eta), axis=1)
+    dm = flat_np_view(events.Tau.decayMode, axis=1)
+    match = flat_np_view(events.Tau.genPartFlav, axis=1)
+    deep_tau = self.config_inst.x.deep_tau
+    tes_nom = np.ones_like(pt, dtype=np.float32)
+    mask2prong = ((dm != 5) & (dm != 6))
+    tes_nom[mask2prong] = self.tes_corrector.evaluate(pt[mask2prong], abseta[mask2prong],
+                                                      dm[mask2prong], match[mask2prong],
+                                                      deep_tau.tagger, deep_tau.vs_jet,
+                                                      deep_tau.vs_e, syst)
+    tes_nom = np.asarray(tes_nom)
+    tau_pt = np.asarray(ak.flatten(events.Tau.pt))
+    tau_mass = np.asarray(ak.flatten(events.Tau.mass))
+    arr_shape = ak.num(events.Tau.pt, axis=1)
+    events = set_ak_column_f32(events, "Tau.pt_no_tes", ak.unflatten(tau_pt, arr_shape))
+    events = set_ak_column_f32(events, "Tau.mass_no_tes", ak.unflatten(tau_mass, arr_shape))
+    events = set_ak_column_f32(events, "Tau.pt", ak.unflatten(tau_pt * tes_nom, arr_shape))
+    events = set_ak_column_f32(events, "Tau.mass", ak.unflatten(tau_mass * tes_nom, arr_shape))
+    return events
+
+
+def tau_energy_scale_per_syst(self, events):
+    # one run of the former implementation per variation
+    return {syst: tau_energy_scale_flatten(self, events, syst) for syst in ["nom", "up", "down"]}
+
+
+def make_events(n_events, seed=42):
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(2.0, n_events)
+    n = int(counts.sum())
+    tau = ak.zip({
+        "pt": ak.unflatten((rng.exponential(25, n) + 15).astype(np.float32), counts),
+        "eta": ak.unflatten(rng.uniform(-2.5, 2.5, n).astype(np.float32), counts),
+        "mass": ak.unflatten(rng.uniform(0.1, 1.7, n).astype(np.float32), counts),
+        "decayMode": ak.unflatten(rng.choice([0, 1, 2, 5, 6, 10, 11], n).astype(np.int32), counts),
+        "genPartFlav": ak.unflatten(rng.choice([0, 1, 2, 3, 4, 5], n).astype(np.uint8), counts),
+    })
+    return ak.Array({"Tau": tau})
+
+
+def measure(func, inst, events):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = func(inst, events)
+    duration = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, duration, peak
+
+
+def main(n_events=1_000_000):
+    events = make_events(n_events)
+    inst = SimpleNamespace(
+        dataset_inst=SimpleNamespace(is_data=False),
+        config_inst=SimpleNamespace(x=SimpleNamespace(deep_tau=SimpleNamespace(
+            tagger="DeepTau2018v2p5", vs_jet="Medium", vs_e="VVLoose",
+        ))),
+        tes_corrector=TESCorrector(),
+    )
+    old_per_syst, t_old, mem_old = measure(tau_energy_scale_per_syst, inst, events)
+    old = old_per_syst["nom"]
+    new, t_new, mem_new = measure(tau_energy_scale.call_func, inst, events)
+
+    for field in ["pt", "mass", "pt_no_tes", "mass_no_tes"]:
+        assert ak.all(old.Tau[field] == new.Tau[field]), f"Tau.{field} differs"
+        assert ak.all(ak.num(old.Tau[field]) == ak.num(new.Tau[field])), f"Tau.{field} differs"
+    for syst in ["up", "down"]:
+        old_syst = old_per_syst[syst]
+        for field in ["pt", "mass"]:
+            assert ak.all(old_syst.Tau[field] == new.Tau[f"{field}_tes_{syst}"]), f"Tau.{field}_tes_{syst} differs"
+    n_taus = len(ak.flatten(events.Tau.pt))
+    print(f"{n_events} events, {n_taus} taus, identical outputs")
+    print(f"{'':>9} {'time [ms]':>10} {'peak alloc [MB]':>16}")
+    print(f"{'flatten':>9} {t_old * 1e3:>10.1f} {mem_old / 1024**2:>16.1f}")
+    print(f"{'fused':>9} {t_new * 1e3:>10.1f} {mem_new / 1024**2:>16.1f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
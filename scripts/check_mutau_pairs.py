@@ -0,0 +1,95 @@
+"""
+Checks that the compiled mu-tau pair builder (build_mutau_pairs, mutau_pair_builder "numba")
+reproduces the awkward one (build_mutau_pairs_awkward) exactly on synthetic chunks: the number of
+pairs per event, the muon and tau indices, the dR values bit by bit, the preselection and the
+pairs chosen by select_single_pair and select_from_multiple_pairs. Pairs are also built with dR
+close to the 0.5 threshold to exercise the boundary.
+
+Usage: python scripts/check_mutau_pairs.py [n_events]
+"""
+import sys
+import time
+
+import numpy as np
+import awkward as ak
+
+from higgs_cp.selection.lepton import (
+    build_mutau_pairs, build_mutau_pairs_awkward, select_single_pair, select_from_multiple_pairs,
+)
+
+
+def make_events(n_events, rng):
+    def collection(counts, extra):
+        n = counts.sum()
+        fields = {
+            "pt": rng.exponential(30, n) + 20,
+            "eta": rng.uniform(-2.4, 2.4, n),
+            "phi": rng.uniform(-np.pi, np.pi, n),
+            "mass": rng.uniform(0.1, 1.7, n),
+            **extra(n),
+        }
+        return ak.zip({
+            name: ak.unflatten(np.asarray(value, dtype=np.float32), counts)
+            for name, value in fields.items()
+        })
+
+    mu_counts = rng.poisson(1.5, n_events)
+    tau_counts = rng.poisson(2.5, n_events)
+    muon = collection(mu_counts, lambda n: {
+        "mT": rng.exponential(40, n),
+        "pfRelIso04_all": rng.exponential(0.15, n),
+    })
+    tau = collection(tau_counts, lambda n: {"rawDeepTau2018v2p5VSjet": rng.random(n)})
+
+    #Place the first tau near dR = 0.5 from the first muon in a part of the events
+    first_mu = ak.firsts(muon)
+    near = (mu_counts > 0) & (tau_counts > 0) & (rng.random(n_events) < 0.3)
+    angle = rng.uniform(0, 2 * np.pi, n_events)
+    dr = 0.5 + rng.normal(0, 1e-6, n_events)
+    tau_offsets = np.concatenate([[0], np.cumsum(tau_counts)])[:-1][near]
+    tau_eta = np.asarray(ak.flatten(tau.eta)).copy()
+    tau_phi = np.asarray(ak.flatten(tau.phi)).copy()
+    tau_eta[tau_offsets] = (np.asarray(ak.fill_none(first_mu.eta, 0))[near] + dr[near] * np.cos(angle[near]))
+    tau_phi[tau_offsets] = (np.asarray(ak.fill_none(first_mu.phi, 0))[near] + dr[near] * np.sin(angle[near]))
+    tau_phi = (tau_phi + np.pi) % (2 * np.pi) - np.pi
+    tau = ak.with_field(tau, ak.unflatten(tau_eta.astype(np.float32), tau_counts), "eta")
+    tau = ak.with_field(tau, ak.unflatten(tau_phi.astype(np.float32), tau_counts), "phi")
+
+    events = ak.Array({"Muon": muon, "Tau": tau})
+    muon_mask = ak.unflatten(rng.random(mu_counts.sum()) < 0.8, mu_counts)
+    tau_mask = ak.unflatten(rng.random(tau_counts.sum()) < 0.8, tau_counts)
+    return events, muon_mask, tau_mask
+
+
+def main(n_events=200_000):
+    rng = np.random.default_rng(42)
+    events, muon_mask, tau_mask = make_events(n_events, rng)
+    # compile the kernel outside of the measurement
+    build_mutau_pairs(events[:10], muon_mask[:10], tau_mask[:10])
+
+    t0 = time.perf_counter()
+    awk = build_mutau_pairs_awkward(events, muon_mask, tau_mask)
+    t_awk = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    nb = build_mutau_pairs(events, muon_mask, tau_mask)
+    t_nb = time.perf_counter() - t0
+
+    for key in ["n", "offsets", "mu_idx", "tau_idx", "dr", "mt", "presel"]:
+        n_diff = np.sum(awk[key] != nb[key])
+        print(f"{key}: {n_diff} differences")
+        assert n_diff == 0, key
+    print(f"{np.sum(np.abs(awk.dr - 0.5) < 1e-5)} pairs within 1e-5 of the dR threshold")
+
+    for select in [select_single_pair, lambda pairs: select_from_multiple_pairs(events, pairs)]:
+        mask_awk, mu_awk, tau_awk = select(awk)
+        mask_nb, mu_nb, tau_nb = select(nb)
+        assert np.array_equal(mask_awk, mask_nb)
+        assert ak.all(ak.flatten(mu_awk) == ak.flatten(mu_nb))
+        assert ak.all(ak.flatten(tau_awk) == ak.flatten(tau_nb))
+
+    print(f"{n_events} events, {len(nb.dr)} pairs, identical pair indices and selections")
+    print(f"awkward {t_awk * 1e3:.1f} ms, numba {t_nb * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,137 @@
+"""
+Checks that the numba engine of trigger_matching (trigger_matching_engine "numba") computes the
+same step as the awkward one on synthetic chunks: the pair muon matched to a trigger object of the
+first trigger leg with dR < 0.5. Trigger objects are also placed close to dR = 0.5 from the pair
+muon to exercise the boundary, and part of the pairs is emptied as done by the vetoes before the
+matching. The dR values of the compiled matcher are checked bit by bit against coffea's delta_r.
+
+Usage: python scripts/check_trigger_matching.py [n_events]
+"""
+import sys
+import time
+
+import numpy as np
+import awkward as ak
+
+from columnflow.selection import SelectionResult
+from columnflow.util import DotDict
+from higgs_cp.config.util import Trigger, TriggerLeg
+from higgs_cp.selection.trigger import trigger_matching
+from higgs_cp.selection.util import SelectionContext
+
+
+def make_events(n_events, rng):
+    def collection(counts, extra):
+        n = counts.sum()
+        fields = {
+            "pt": rng.exponential(30, n) + 20,
+            "eta": rng.uniform(-2.4, 2.4, n),
+            "phi": rng.uniform(-np.pi, np.pi, n),
+            "mass": rng.uniform(0.1, 1.7, n),
+            **extra(n),
+        }
+        return ak.zip({
+            name: ak.unflatten(np.asarray(value, dtype=np.float32), counts)
+            for name, value in fields.items()
+        })
+
+    mu_counts = rng.poisson(1.5, n_events)
+    tau_counts = rng.poisson(2.5, n_events)
+    obj_counts = rng.poisson(4, n_events)
+    muon = collection(mu_counts, lambda n: {})
+    tau = collection(tau_counts, lambda n: {})
+    trig_obj = collection(obj_counts, lambda n: {"id": rng.choice([13, 15], n)})
+
+    #Place the first trigger object near dR = 0.5 from the first muon in a part of the events
+    first_mu = ak.firsts(muon)
+    near = (mu_counts > 0) & (obj_counts > 0) & (rng.random(n_events) < 0.5)
+    angle = rng.uniform(0, 2 * np.pi, n_events)
+    dr = 0.5 + rng.normal(0, 1e-6, n_events)
+    obj_offsets = np.concatenate([[0], np.cumsum(obj_counts)])[:-1][near]
+    obj_eta = np.asarray(ak.flatten(trig_obj.eta)).copy()
+    obj_phi = np.asarray(ak.flatten(trig_obj.phi)).copy()
+    obj_eta[obj_offsets] = (np.asarray(ak.fill_none(first_mu.eta, 0))[near] + dr[near] * np.cos(angle[near]))
+    obj_phi[obj_offsets] = (np.asarray(ak.fill_none(first_mu.phi, 0))[near] + dr[near] * np.sin(angle[near]))
+    obj_phi = (obj_phi + np.pi) % (2 * np.pi) - np.pi
+    trig_obj = ak.with_field(trig_obj, ak.unflatten(obj_eta.astype(np.float32), obj_counts), "eta")
+    trig_obj = ak.with_field(trig_obj, ak.unflatten(obj_phi.astype(np.float32), obj_counts), "phi")
+
+    events = ak.Array({
+        "event": np.arange(n_events, dtype=np.uint64),
+        "Muon": muon,
+        "Tau": tau,
+        "TrigObj": trig_obj,
+    })
+
+    #First muon and tau as pair, emptied in part of the events as by the vetoes
+    def first_index(mask):
+        return ak.unflatten(np.zeros(mask.sum(), dtype=np.int64), mask.astype(np.int64))
+
+    has_pair = (mu_counts > 0) & (tau_counts > 0)
+    kept = has_pair & (rng.random(n_events) < 0.8)
+    pair_mu_idx, pair_tau_idx = first_index(has_pair), first_index(has_pair)
+    vetoed_mu_idx, vetoed_tau_idx = first_index(kept), first_index(kept)
+
+    #Trigger results of a single muon and a cross trigger, the object masks of the legs select
+    #objects by their id and a random filter bit
+    triggers = [
+        Trigger(name="HLT_IsoMu24", id=131, legs=[TriggerLeg(pdg_id=13)]),
+        Trigger(name="HLT_IsoMu20_LooseDeepTauPFTauHPS27", id=1315, legs=[
+            TriggerLeg(pdg_id=13),
+            TriggerLeg(pdg_id=15),
+        ]),
+    ]
+    trig_obj_mask = [
+        (trig_obj.id == pdg_id) & ak.unflatten(rng.random(obj_counts.sum()) < 0.7, obj_counts)
+        for pdg_id in [13, 13, 15]
+    ]
+    fired = [rng.random(n_events) < 0.6 for _ in triggers]
+    trigger_data = [
+        (triggers[0], fired[0], trig_obj_mask[:1]),
+        (triggers[1], fired[1], trig_obj_mask[1:]),
+    ]
+    trigger_results = SelectionResult(aux={"trigger_data": trigger_data, "trig_obj_mask": trig_obj_mask})
+    return events, pair_mu_idx, pair_tau_idx, vetoed_mu_idx, vetoed_tau_idx, trigger_results
+
+
+def run_engine(engine, events, pair_mu_idx, pair_tau_idx, vetoed_mu_idx, vetoed_tau_idx, trigger_results):
+    self = DotDict(config_inst=DotDict(x=lambda name, default: engine))
+    context = SelectionContext(events, pair_mu_idx, pair_tau_idx)
+    t0 = time.perf_counter()
+    _, result = trigger_matching.call_func(
+        self, events, vetoed_mu_idx, vetoed_tau_idx, trigger_results, context=context,
+    )
+    return result, time.perf_counter() - t0
+
+
+def main(n_events=200_000):
+    rng = np.random.default_rng(42)
+    # compile the kernel outside of the measurement
+    run_engine("numba", *make_events(10, rng))
+    inputs = make_events(n_events, rng)
+    events, pair_mu_idx = inputs[:2]
+
+    awk, t_awk = run_engine("awkward", *inputs)
+    nb, t_nb = run_engine("numba", *inputs)
+
+    step_awk = np.asarray(awk.steps.trigger_matching)
+    step_nb = np.asarray(nb.steps.trigger_matching)
+    print(f"trigger_matching: {np.sum(step_awk != step_nb)} differences")
+    assert np.array_equal(step_awk, step_nb)
+    for coll in ["Muon", "Tau"]:
+        assert ak.all(ak.num(awk.objects[coll][coll]) == ak.num(nb.objects[coll][coll]))
+        assert ak.all(ak.flatten(awk.objects[coll][coll]) == ak.flatten(nb.objects[coll][coll]))
+
+    #The boundary cases only agree when the dR values are the same as coffea's bit by bit
+    context = SelectionContext(events, pair_mu_idx, inputs[2])
+    trig_obj = context._lorentz_view(events.TrigObj, inputs[5].x.trig_obj_mask[0])
+    (pair_mu, _) = ak.broadcast_arrays(context.pair_muon[:, np.newaxis], trig_obj)
+    dr = ak.flatten(ak.fill_none(trig_obj.delta_r(pair_mu), 999))
+    print(f"{np.sum(np.abs(np.asarray(dr) - 0.5) < 1e-5)} trigger objects within 1e-5 of the dR threshold")
+
+    print(f"{n_events} events, {step_nb.sum()} matched, identical steps and pair indices")
+    print(f"awkward {t_awk * 1e3:.1f} ms, numba {t_nb * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,27 @@
+"""
+Writes small local replicas of the pileup profiles, muon scale factors and tau corrections in the
+external files of the analysis configs, see higgs_cp/benchmark/replicas.py. The replicas have the
+structure of the original files but synthetic values. To use them, set HIGGS_CP_EXTERNAL_REPLICAS
+to the same directory before running any task:
+
+    python scripts/make_external_replicas.py $PWD/data/replicas
+    export HIGGS_CP_EXTERNAL_REPLICAS=$PWD/data/replicas
+
+Usage: python scripts/make_external_replicas.py directory [config ...]
+"""
+import sys
+
+from higgs_cp.config.analysis_higgs_cp import analysis_higgs_cp
+from higgs_cp.benchmark.replicas import make_external_replicas
+
+
+def main(directory, *config_names):
+    for config_inst in analysis_higgs_cp.configs:
+        if config_names and config_inst.name not in config_names:
+            continue
+        for key, path in make_external_replicas(config_inst, directory).items():
+            print(f"{config_inst.name}: {key} -> {path}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])